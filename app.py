@@ -3,18 +3,25 @@ from transcribe.transcribe import *
 from salesforce.salesforce_helpers import *
 from google.oauth2 import service_account
 from twiliohelpers.twilio_handlers import twilio_client
-from gcs.gcs_handlers import check_gcs_permissions, get_latest_gcs_files, process_and_upload_audio
+from twiliohelpers.media_stream import load_live_transcripts, load_live_conversation
+from gcs.gcs_handlers import check_gcs_permissions, get_latest_gcs_files, process_and_upload_audio, upload_stereo_audio
 from utils import check_password
 import os
 from dotenv import load_dotenv
 import requests
 from requests.auth import HTTPBasicAuth
-from anthropic import Anthropic
+from llm.llm_handlers import prompt_parts, SUMMARY_MAX_TOKENS
+from llm.sections import section_requests, merge_sections
 from fillpdf.topdf import fill_and_flatten_pdf
 from transcribe.validate import validate_form
-from utils import extract_form_with_confidence, extract_form_without_confidence
+from transcribe.words import WordTable
+from transcribe.conversation import compact_conversation
+from utils import extract_form_without_confidence, FormStreamParser
+from assets import load_demo_transcripts, load_demo_audio, load_demo_form, load_text_asset, load_clip_store, load_llm_client, load_form_sections
+from tracing import span, set_recording, load_trace, summarize_trace
 import re
 import json
+import io
 from pydub import AudioSegment
 
 # Loading environment variables
@@ -52,36 +59,23 @@ salesforce_credentials = {
 
 
 def initialize_session_state():
-    # Initialize transcription_results
-    transcription_files = [
-        'docs/logs_20241004_181841.json',
-        'docs/logs_20241004_181540.json'
-    ]
+    # Demo assets are loaded once per process and shared by reference across sessions
     if 'transcription_results' not in st.session_state:
-        st.session_state.transcription_results = []
-        for file in transcription_files:
-            with open(file, 'r') as f:
-                st.session_state.transcription_results.append(json.load(f))
+        st.session_state.transcription_results = list(load_demo_transcripts())
 
     # Initialize conversation
     if 'conversation' not in st.session_state:
-        with open('docs/filtered_conversation_conf.txt', 'r') as f:
-            st.session_state.conversation = f.read()
+        st.session_state.conversation = load_text_asset('docs/filtered_conversation_conf.txt')
 
-    # Initialize audio_files with AudioSegment objects from local files
-    if 'audio_files' not in st.session_state:
-        audio_file_paths = ["docs/bechichi.wav", "docs/boubou.wav"]
-        st.session_state.audio_files = []
-        for file_path in audio_file_paths:
-            audio_segment = AudioSegment.from_wav(file_path)
-            st.session_state.audio_files.append(audio_segment)
+    # audio_files is only set once a recording is processed; the demo audio is
+    # loaded lazily by validation (see current_audio_files)
 
     # Initialize form
     if 'conf_form' not in st.session_state:
-        with open('docs/ai_response_conf.txt', 'r', encoding="utf-8") as f:
-            st.session_state.conf_form = extract_form_with_confidence(f.read())
+        st.session_state.conf_form = load_demo_form()
     
     if 'cleaned_form' not in st.session_state:
+        # Edited in place by the issue list, so each session gets its own copy
         st.session_state.cleaned_form = extract_form_without_confidence(st.session_state.conf_form)
 
     # Initialize other session state variables
@@ -101,12 +95,18 @@ def initialize_session_state():
         st.session_state.recordings = []
 
     if 'generated_text_summary' not in st.session_state:
-        with open('docs/ai_summary.txt', 'r') as f:
-            st.session_state.generated_text_summary = f.read()
+        st.session_state.generated_text_summary = load_text_asset('docs/ai_summary.txt')
+
+def current_audio_files():
+    return st.session_state.get('audio_files') or list(load_demo_audio())
+
 # Call this function at the start of your app
 initialize_session_state()
 
 if check_password():
+    # Every stage timed during this run is attributed to the recording being processed
+    set_recording(st.session_state.get('recording_sid'))
+
     # Streamlit Application
     st.title("Speech-to-Text Transcription and Call Management")
 
@@ -131,6 +131,21 @@ if check_password():
                     st.error(f"Erreur lors de l'appel: {str(e)}")
             else:
                 st.warning("Veuillez entrer les deux numéros de téléphone")
+
+        # Pipeline mode: one dual-channel recognition or two mono recognitions
+        st.header("Pipeline mode")
+        stereo_mode = st.radio(
+            "Transcription mode",
+            options=["Dual-channel", "Split channels"],
+            help="Dual-channel uploads the stereo recording once and transcribes both channels in a single request."
+        ) == "Dual-channel"
+
+        # Transcript format sent to the model
+        compact_prompt = st.radio(
+            "Prompt transcript",
+            options=["Compact", "Full"],
+            help="Compact marks only low-confidence words (word~3 for 0.3) instead of a confidence line per turn, about half the input tokens."
+        ) == "Compact"
     # Section to get and process recordings
     st.header("Process recordings")
     if st.button("Fetch latest 5 recordings"):
@@ -150,15 +165,33 @@ if check_password():
         if st.button("Process selected recording"):
             selected_recording = next(rec for rec in st.session_state.recordings if rec.sid == selected_sid)
             st.write(f"Processing recording SID: {selected_recording.sid}")
+            st.session_state.recording_sid = selected_recording.sid
+            set_recording(selected_recording.sid)
             
             # Download the stereo recording
             stereo_url = f"https://api.twilio.com/2010-04-01/Accounts/{os.getenv('TWILIO_ACCOUNT_SID')}/Recordings/{selected_recording.sid}.wav?RequestedChannels=2"
-            response = requests.get(stereo_url, auth=HTTPBasicAuth(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN')))
+            with span("twilio_download") as trace:
+                response = requests.get(stereo_url, auth=HTTPBasicAuth(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN')))
+                trace.add(bytes=len(response.content))
+                trace.tag(http_status=response.status_code)
             
-            if response.status_code == 200:
+            live_transcripts = load_live_transcripts(selected_recording.call_sid)
+            if response.status_code == 200 and live_transcripts is not None:
+                # The call was transcribed live from the media stream: no upload or batch transcription needed
+                st.session_state.audio_files = AudioSegment.from_wav(io.BytesIO(response.content)).split_to_mono()
+                st.session_state.transcription_results = [WordTable.from_dict(transcript, channel=i) for i, transcript in enumerate(live_transcripts)]
+                # The conversation was also built incrementally during the call
+                st.session_state.conversation = load_live_conversation(selected_recording.call_sid) \
+                    or rearrange_conversation(*st.session_state.transcription_results)
+                st.success("Live transcript found for this call, conversation ready.")
+            elif response.status_code == 200:
                 # Process and upload the audio
                 bucket_name = "excalibur-testing"  # Replace with your actual bucket name
-                gcs_uris, channels = process_and_upload_audio(response.content, bucket_name, credentials)
+                if stereo_mode:
+                    gcs_uri, channels = upload_stereo_audio(response.content, bucket_name, credentials)
+                    gcs_uris = [gcs_uri]
+                else:
+                    gcs_uris, channels = process_and_upload_audio(response.content, bucket_name, credentials)
 
                 # Overwrite the audio_files in session state
                 st.session_state.audio_files = channels
@@ -179,101 +212,141 @@ if check_password():
             
             if latest_files:
                 file_options = {file: f"Select {file}" for file in latest_files}
+                required_files = 1 if stereo_mode else 2
                 st.session_state.selected_files = st.multiselect(
-                    "Select two files to transcribe (caller and receiver)", 
+                    "Select the stereo call recording" if stereo_mode else "Select two files to transcribe (caller and receiver)", 
                     options=list(file_options.keys()), 
                     format_func=lambda x: file_options[x],
                     key='file_selector',
-                    max_selections=2
+                    max_selections=required_files
                 )
 
-                if len(st.session_state.selected_files) == 2 and st.button("Transcribe selected files"):
+                if len(st.session_state.selected_files) == required_files and st.button("Transcribe selected files"):
                     st.session_state.transcription_requested = True
                     st.session_state.conversation = None
 
-                if st.session_state.transcription_requested:
+                if st.session_state.transcription_requested and stereo_mode:
+                    file = st.session_state.selected_files[0]
+                    gcs_uri = f"gs://{bucket_name}/{file}"
+                    
+                    st.info(f"Starting dual-channel transcription for {file}...")
+                    try:
+                        # Caller and receiver transcripts from a single recognition
+                        st.session_state.transcription_results = transcribe_gcs_stereo(gcs_uri, credentials)
+                        st.success(f"Transcription for {file} completed successfully.")
+                    except Exception as e:
+                        st.error(f"An error occurred during transcription of {file}: {str(e)}")
+                elif st.session_state.transcription_requested:
                     for i, file in enumerate(st.session_state.selected_files):
                         gcs_uri = f"gs://{bucket_name}/{file}"
-                        
+
                         st.info(f"Starting transcription for {file}...")
                         try:
-                            transcript = transcribe_gcs_large(gcs_uri, credentials)
+                            # Files already transcribed with the same config are served from the cache
+                            transcript, cached = transcribe_gcs_large(gcs_uri, credentials, channel=i, return_cached=True)
                             # Update the session state with the transcript logs
                             st.session_state.transcription_results[i] = transcript
-                            st.success(f"Transcription for {file} completed successfully.")
+                            if cached:
+                                st.success(f"{file} already transcribed, loaded from cache.")
+                            else:
+                                st.success(f"Transcription for {file} completed successfully.")
                         except Exception as e:
                             st.error(f"An error occurred during transcription of {file}: {str(e)}")
-            
-                    if len(st.session_state.transcription_results) == 2:
-                        caller_transcript, receiver_transcript = st.session_state.transcription_results
-                        st.session_state.conversation = rearrange_conversation(caller_transcript, receiver_transcript)
-                        
-                        st.subheader("Rearranged Conversation:")
-                        st.text_area("Conversation:", value=st.session_state.conversation, height=300)
-                        
-                        # Offer download of rearranged conversation
-                        st.download_button(
-                            label="Download rearranged conversation",
-                            data=st.session_state.conversation,
-                            file_name="docs/filtered_conversation_conf.txt",
-                            mime="text/plain"
-                        )
+
+                # Stereo or split transcription: the conversation is rebuilt from both channels
+                if st.session_state.transcription_requested and len(st.session_state.transcription_results) == 2:
+                    caller_transcript, receiver_transcript = st.session_state.transcription_results
+                    st.session_state.conversation = rearrange_conversation(caller_transcript, receiver_transcript)
+                    
+                    st.subheader("Rearranged Conversation:")
+                    st.text_area("Conversation:", value=st.session_state.conversation, height=300)
+                    
+                    # Offer download of rearranged conversation
+                    st.download_button(
+                        label="Download rearranged conversation",
+                        data=st.session_state.conversation,
+                        file_name="docs/filtered_conversation_conf.txt",
+                        mime="text/plain"
+                    )
             else:
                 st.warning("No files found in the bucket.")
         else:
             st.error("GCS permission check failed. Please check your Google Cloud setup.")
 
     # New section for Claude 3.5 Sonnet API request
-    st.header("Generate AI Response")
+    st.header("Analyze call")
 
     # Load prompt template
-    with open("docs/prompt_template.txt", "r", encoding="utf-8") as file:
-        prompt_template = file.read()
-    with open("docs/prompt_summary.txt", "r", encoding="utf-8") as file:
-        prompt_summary = file.read()
-
-    # Load form and transcript
-    with open("docs/form_short.txt", "r", encoding="utf-8") as file:
-        form_text = file.read()
-
-    # Prepare the prompt
-    prompt = prompt_template.format(form=form_text, transcript=st.session_state.conversation)
-    #resume prompt
-    summary_prompt = prompt_summary.format(transcript=st.session_state.conversation)
-
-    if st.button("Generate AI Response"):
-        try:
-            # Initialize Anthropic client
-            anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
-            # Send request to Anthropic API using the Messages API
-            response = anthropic_client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=8192,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-
-            # Get the generated text
-            generated_text = response.content[0].text
+    prompt_template = load_text_asset("docs/prompt_template_compact.txt" if compact_prompt else "docs/prompt_template.txt")
+    prompt_summary = load_text_asset("docs/prompt_summary.txt")
+
+    # The form is split into sections filled by concurrent requests over the same transcript
+    form_sections = load_form_sections()
+    prompt_transcript = st.session_state.conversation
+    if compact_prompt and prompt_transcript:
+        prompt_transcript = compact_conversation(prompt_transcript)
+    #resume prompt : transcription complète, le gabarit du résumé n'explique pas les marques "~N"
+    summary_prefix, summary_suffix = prompt_parts(prompt_summary, "transcript", transcript=st.session_state.conversation)
+
+    if st.button("Analyze call"):
+        # Form sections and summary requested together and streamed: the wait is the longest call
+        st.subheader("AI Response:")
+        form_placeholder = st.empty()
+        st.subheader("AI Generated Summary:")
+        summary_placeholder = st.empty()
+        summary_text = ""
+        responses = {}
+        # Fields are parsed as soon as they are complete, while the sections are still generating
+        parsers = {section.request_name: FormStreamParser() for section in form_sections}
+
+        requests_by_name = {
+            "summary": dict(prefix=summary_prefix, suffix=summary_suffix, stage="llm.summary",
+                            max_tokens=SUMMARY_MAX_TOKENS),
+            **section_requests(form_sections, prompt_template, prompt_transcript),
+        }
+        for event in load_llm_client().stream_many(requests_by_name):
+            if event.error is not None:
+                st.error(f"An error occurred while generating the AI {event.name}: {str(event.error)}")
+            elif event.response is not None:
+                responses[event.name] = event.response
+            elif event.name == "summary":
+                summary_text += event.text
+                summary_placeholder.markdown(summary_text)
+            elif parsers[event.name].feed(event.text):
+                form_placeholder.dataframe(
+                    [{"field": field, "réponse": value['réponse'], "confiance": min(value['confiance'])}
+                     for section in form_sections for field, value in parsers[section.request_name].fields.items()],
+                    use_container_width=True
+                )
 
-            # Update the session state with the AI response
-            st.session_state.conf_form = extract_form_with_confidence(generated_text)
+        section_texts = {name: response.text for name, response in responses.items() if name != "summary"}
+        if section_texts:
+            # Update the session state with the merged sections
+            st.session_state.conf_form = merge_sections(form_sections, section_texts)
             st.session_state.cleaned_form = extract_form_without_confidence(st.session_state.conf_form)
-            # Display info message
-            st.info("AI response generated successfully!")
+            st.info(f"AI response generated successfully! ({len(section_texts)}/{len(form_sections)} sections)")
 
             # Offer download of generated text
             st.download_button(
                 label="Download AI Response",
-                data=generated_text.encode("utf-8"),
+                data=json.dumps(st.session_state.conf_form, ensure_ascii=False, indent=2).encode("utf-8"),
                 file_name="docs/ai_response_conf.txt",
                 mime="text/plain"
             )
 
-        except Exception as e:
-            st.error(f"An error occurred while generating the AI response: {str(e)}")
+        if "summary" in responses:
+            generated_text_summary = responses["summary"].text
+            st.session_state.generated_text_summary = generated_text_summary
+            summary_placeholder.text_area("Contenu:", value=generated_text_summary, height=300, disabled=True)
+            st.info("AI summary generated successfully!")
+
+            # Offer download of generated text
+            st.download_button(
+                label="Download Summary",
+                data=generated_text_summary.encode("utf-8"),
+                file_name="summary.txt",
+                mime="text/plain"
+            )
 
    
     # New section for form validation
@@ -282,7 +355,9 @@ if check_password():
     if st.button("Validate Form"):
         try:
             # Validate the form
-            st.session_state.issues = validate_form(st.session_state.conf_form, st.session_state.transcription_results, st.session_state.audio_files)
+            # Clips are kept once in the shared store; the session only holds their ids
+            st.session_state.issues = validate_form(st.session_state.conf_form, st.session_state.transcription_results,
+                                                    current_audio_files(), clip_store=load_clip_store())
 
         except Exception as e:
             st.error(f"An error occurred during form validation: {str(e)}")
@@ -302,15 +377,17 @@ if check_password():
         # Display issues and allow editing
         if st.session_state.issues:
             st.subheader("Issues:")
-            for i, (warning, audio) in enumerate(st.session_state.issues):
+            for i, (warning, clip_id) in enumerate(st.session_state.issues):
                 col1, col2, col3 = st.columns([3, 1, 1])
                 
                 with col1:
                     st.warning(warning)
                 
                 with col2:
-                    if audio is not None:
-                        st.audio(audio, format="audio/wav")
+                    clip = load_clip_store().get(clip_id) if clip_id else None
+                    if clip is not None:
+                        audio, mime_type = clip
+                        st.audio(audio, format=mime_type)
                 
                 # Extract the key from the warning message
                 key = warning.split(":")[0].split("for ")[-1].strip()
@@ -334,23 +411,18 @@ if check_password():
                 # Use the cleaned form directly
                 data_dict = st.session_state.cleaned_form
 
-                # Define paths
-                input_pdf_path = "docs/form.pdf"
-                output_pdf_path = "docs/filled_form.pdf"
-
-                # Fill and flatten the PDF
-                fill_and_flatten_pdf(input_pdf_path, data_dict, output_pdf_path)
+                # Fill and flatten the PDF in memory: each session keeps its own copy
+                st.session_state.filled_pdf = fill_and_flatten_pdf("docs/form.pdf", data_dict)
 
                 st.success("PDF generated successfully!")
 
                 # Offer download of generated PDF
-                with open(output_pdf_path, "rb") as file:
-                    st.download_button(
-                        label="Download Filled PDF",
-                        data=file.read(),
-                        file_name="filled_form.pdf",
-                        mime="application/pdf"
-                    )
+                st.download_button(
+                    label="Download Filled PDF",
+                    data=st.session_state.filled_pdf,
+                    file_name="filled_form.pdf",
+                    mime="application/pdf"
+                )
 
             except Exception as e:
                 st.error(f"An error occurred while generating the PDF: {str(e)}")
@@ -360,42 +432,24 @@ if check_password():
     if st.button("Connect Salesforce"): 
         access_token = request_access_token_using_refresh_token(salesforce_credentials['refresh_token'])
         st.session_state['access_token'] = access_token  
-    if st.button("Generate summary"):
-        try:
-            # Initialize Anthropic client
-            anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-            # Send request to Anthropic API using the Messages API
-            response = anthropic_client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=8192,
-                messages=[
-                    {"role": "user", "content": summary_prompt}
-                ]
-            )
-
-            # Get the generated text
-            generated_text_summary = response.content[0].text
-            st.session_state.generated_text_summary = generated_text_summary
-            # Display info message
-            st.info("AI summary generated successfully!")
-            st.subheader("AI Generated Summary:")
-            st.text_area("Contenu:", value=generated_text_summary, height=300, disabled=True)
-
-            # Offer download of generated text
-            st.download_button(
-                label="Download Summary",
-                data=generated_text_summary.encode("utf-8"),
-                file_name="summary.txt",
-                mime="text/plain"
-            )
-
-        except Exception as e:
-            st.error(f"An error occurred while generating the AI response: {str(e)}")
-
     if st.button("Send  to Salesforce"):
         if 'access_token' in st.session_state:
             access_token = st.session_state['access_token']
             account_id = create_account(access_token, salesforce_credentials['instance_url'])
             opportunity_id = create_opportunity(access_token, account_id, salesforce_credentials['instance_url'])
             add_note_to_account(access_token, account_id, salesforce_credentials['instance_url'])
-            upload_file_to_account(access_token, "docs/filled_form.pdf", account_id, salesforce_credentials['instance_url'])  
\ No newline at end of file
+            if st.session_state.get('filled_pdf'):
+                upload_file_to_account(access_token, st.session_state.filled_pdf, account_id, salesforce_credentials['instance_url'], "filled_form.pdf")
+            else:
+                st.warning("Generate the PDF before sending it to Salesforce.")
+
+    # Per-call breakdown of the stage timings recorded in logs/traces.jsonl
+    if st.session_state.get('recording_sid'):
+        st.header("Pipeline timings")
+        stages = summarize_trace(load_trace(st.session_state.recording_sid))
+        if stages:
+            st.caption(f"Recording {st.session_state.recording_sid}: {sum(row['seconds'] for row in stages):.1f} s across {len(stages)} stages")
+            st.dataframe(stages, use_container_width=True)
+            st.bar_chart(stages, x="stage", y="seconds")
+        else:
+            st.info("No stage recorded yet for this recording.")
@@ -0,0 +1,68 @@
+import streamlit as st
+from transcribe.clips import PcmChannel, ClipStore
+from llm.llm_handlers import LLMClient
+from llm.sections import load_sections
+from transcribe.words import WordTable
+from utils import extract_form_with_confidence
+import json
+import os
+
+# Transcriptions de démonstration, dans l'ordre des canaux
+DEMO_TRANSCRIPTS = [
+    'docs/logs_20241004_181841',
+    'docs/logs_20241004_181540'
+]
+DEMO_AUDIO = ["docs/bechichi.wav", "docs/boubou.wav"]
+
+# Les ressources ci-dessous sont chargées une seule fois par processus, au premier
+# usage, et partagées par référence entre toutes les sessions : ne pas les modifier.
+
+
+def load_transcript_asset(base_path, channel=0):
+    # Format binaire .npz s'il existe, sinon conversion depuis le JSON d'origine
+    if os.path.exists(f"{base_path}.npz"):
+        table = WordTable.load(f"{base_path}.npz")
+    else:
+        with open(f"{base_path}.json", "r") as f:
+            table = WordTable.from_dict(json.load(f))
+    return table.with_channel(channel).freeze()
+
+
+@st.cache_resource(show_spinner=False)
+def load_demo_transcripts():
+    return tuple(load_transcript_asset(path, channel=i) for i, path in enumerate(DEMO_TRANSCRIPTS))
+
+
+@st.cache_resource(show_spinner=False)
+def load_demo_audio():
+    # Projetés en mémoire : seules les pages des extraits écoutés sont lues
+    return tuple(PcmChannel.from_wav(path) for path in DEMO_AUDIO)
+
+
+@st.cache_resource(show_spinner=False)
+def load_text_asset(path):
+    with open(path, 'r', encoding="utf-8") as f:
+        return f.read()
+
+
+@st.cache_resource(show_spinner=False)
+def load_demo_form():
+    return extract_form_with_confidence(load_text_asset('docs/ai_response_conf.txt'))
+
+
+@st.cache_resource(show_spinner=False)
+def load_form_sections():
+    # Sections du formulaire remplies chacune par sa propre requête
+    return tuple(load_sections(load_text_asset("docs/form_short.txt")))
+
+
+@st.cache_resource(show_spinner=False)
+def load_clip_store():
+    # Extraits audio des problèmes de validation, partagés : les sessions ne gardent que leur id
+    return ClipStore()
+
+
+@st.cache_resource(show_spinner=False)
+def load_llm_client():
+    # Un seul client Anthropic (connexions réutilisées) et un cache de réponses commun
+    return LLMClient()
@@ -0,0 +1,181 @@
+"""Microbenchmarks for the pure-Python hot paths of the pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline                   # compare with the baseline
+    python -m benchmarks.bench_pipeline --save-baseline   # record a new baseline
+    python -m benchmarks.bench_pipeline --check           # exit 1 on regressions
+
+Transcripts are scaled by repeating the sample call back to back (1x, 10x,
+100x call length) so scaling curves are visible in the report.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from pydub import AudioSegment
+
+from assets import load_transcript_asset
+from fillpdf.topdf import fill_and_flatten_pdf
+from transcribe.conversation import compact_conversation
+from transcribe.transcribe import rearrange_conversation
+from transcribe.validate import AudioFinder, validate_form
+from transcribe.words import WordTable
+import tracing
+from utils import extract_form_with_confidence, extract_form_without_confidence
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TRANSCRIPTS = ['docs/logs_20241004_181841', 'docs/logs_20241004_181540']
+AI_RESPONSE = 'docs/ai_response_conf.txt'
+CONVERSATION = 'docs/filtered_conversation_conf.txt'  # format complet, avec lignes "Confidence:"
+FORM_PDF = 'docs/form.pdf'
+REGRESSION_FACTOR = 1.5  # plus lent que 1,5 x la référence = régression
+
+
+def scale_transcript(table, factor):
+    # Répéter l'appel bout à bout pour simuler un appel factor fois plus long
+    if factor == 1:
+        return table
+    span = float(max(table.end.max(), 0)) + 1.0
+    result_span = int(table.result_ids.max()) + 1 if len(table) else 0
+    return WordTable.concat([
+        WordTable(table.vocab, table.word_ids, table.start + i * span, table.end + i * span,
+                  table.confidence, table.channel, table.result_ids + i * result_span)
+        for i in range(factor)
+    ])
+
+
+def synthetic_audio(transcripts):
+    # Silence de la durée de l'appel, un canal par transcription
+    duration_ms = int(max(float(table.end.max()) for table in transcripts) * 1000) + 1000
+    return [AudioSegment.silent(duration=duration_ms, frame_rate=8000).set_sample_width(2) for _ in transcripts]
+
+
+def measure(function, repeat, min_sample_seconds=0.02):
+    # Les fonctions très rapides sont répétées en boucle pour dépasser la résolution de l'horloge
+    start = time.perf_counter()
+    function()
+    loops = max(1, int(min_sample_seconds / max(time.perf_counter() - start, 1e-9)))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        timings.append((time.perf_counter() - start) / loops)
+    return statistics.median(timings)
+
+
+def build_cases(scales, audio_scales):
+    transcripts = [load_transcript_asset(path, channel=i) for i, path in enumerate(TRANSCRIPTS)]
+    with open(AI_RESPONSE, 'r', encoding="utf-8") as f:
+        ai_response = f.read()
+    with open(CONVERSATION, 'r', encoding="utf-8") as f:
+        conversation = f.read().strip()
+    conf_form = extract_form_with_confidence(ai_response)
+    cleaned_form = extract_form_without_confidence(conf_form)
+    audios = synthetic_audio(transcripts)
+
+    cases = {
+        "extract_form_with_confidence": lambda: extract_form_with_confidence(ai_response),
+        "extract_form_without_confidence": lambda: extract_form_without_confidence(conf_form),
+    }
+
+    for factor in scales:
+        scaled = [scale_transcript(table, factor) for table in transcripts]
+        cases[f"rearrange_conversation[{factor}x]"] = lambda scaled=scaled: rearrange_conversation(*scaled)
+        cases[f"rearrange_conversation_compact[{factor}x]"] = \
+            lambda scaled=scaled: rearrange_conversation(*scaled, compact=True)
+        long_conversation = "\n".join([conversation] * factor)
+        cases[f"compact_conversation[{factor}x]"] = \
+            lambda long_conversation=long_conversation: compact_conversation(long_conversation)
+
+    for factor in audio_scales:
+        scaled = [scale_transcript(table, factor) for table in transcripts]
+        finder = AudioFinder(scaled, audios)
+        values = [value['réponse'] for value in conf_form.values()][:20]
+        cases[f"AudioFinder.get_audio_segment[{factor}x]"] = \
+            lambda finder=finder, values=values: [finder.get_audio_segment(value) for value in values]
+        cases[f"validate_form[{factor}x]"] = lambda scaled=scaled: validate_form(conf_form, scaled, audios)
+
+    output_dir = tempfile.mkdtemp()
+    # Les étapes tracées écrivent hors du journal réel
+    tracing.TRACE_LOG_PATH = os.path.join(output_dir, "traces.jsonl")
+
+    cases["fill_and_flatten_pdf"] = \
+        lambda: fill_and_flatten_pdf(FORM_PDF, cleaned_form, os.path.join(output_dir, "filled_form.pdf"))
+    return cases
+
+
+def run(scales, audio_scales, repeat, only=None):
+    results = {}
+    for name, function in build_cases(scales, audio_scales).items():
+        if only and only not in name:
+            continue
+        results[name] = measure(function, repeat)
+        print(f"{name:45s} {results[name] * 1000:12.2f} ms", file=sys.stderr)
+    return results
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(results, baseline):
+    regressions = []
+    print(f"\n{'benchmark':45s} {'baseline':>12s} {'current':>12s} {'ratio':>8s}")
+    for name, seconds in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            print(f"{name:45s} {'-':>12s} {seconds * 1000:10.2f}ms {'new':>8s}")
+            continue
+        ratio = seconds / reference if reference else float('inf')
+        flag = "  REGRESSION" if ratio > REGRESSION_FACTOR else ""
+        print(f"{name:45s} {reference * 1000:10.2f}ms {seconds * 1000:10.2f}ms {ratio:7.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="call-length multipliers for the transcript benchmarks")
+    parser.add_argument("--audio-scales", type=int, nargs="+", default=[1, 10],
+                        help="call-length multipliers for the AudioFinder/validate_form benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (median is reported)")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this string")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 when a benchmark regresses")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.audio_scales, args.repeat, args.only)
+
+    if args.save_baseline:
+        # Avec --only, seules les mesures refaites remplacent celles de la référence
+        baseline = (load_baseline() if args.only else None) or {"results": {}}
+        baseline["machine"] = f"{platform.system()} {platform.machine()} / Python {platform.python_version()}"
+        baseline["results"].update(results)
+        with open(BASELINE_PATH, 'w', encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}", file=sys.stderr)
+        return 0
+
+    baseline = load_baseline()
+    if baseline is None:
+        print("No baseline recorded yet, run with --save-baseline", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline)
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# Racine du dépôt : les tests importent les modules comme app.py (transcribe, llm, utils...)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+
+class DiskCache:
+    """Persistent key-value store in one directory, bounded in size with LRU eviction.
+
+    Each entry is a file named after its key; the file's modification time
+    records the last access and drives eviction. Subclasses give the file
+    suffix and how an entry is read (``load``) and written (``dump``).
+    """
+
+    suffix = ""
+    # Une entrée illisible ou absente est un simple défaut de cache
+    read_errors = (FileNotFoundError,)
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def load(self, path):
+        raise NotImplementedError
+
+    def dump(self, value, f):
+        # f : fichier binaire ouvert en écriture
+        raise NotImplementedError
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            value = self.load(path)
+        except self.read_errors:
+            return None
+        # Marquer l'entrée comme récemment utilisée ; une éviction concurrente a pu
+        # la supprimer depuis la lecture, la valeur lue reste valable
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        # Écriture atomique pour ne jamais exposer une entrée partielle
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            self.dump(value, f)
+        os.replace(temp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # déjà évincée par un put concurrent
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        # Supprimer les entrées les moins récemment utilisées en premier
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
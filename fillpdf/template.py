@@ -0,0 +1,89 @@
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+from pdfrw import PdfReader, PdfDict, PdfName
+import os
+
+CHECKBOX_FLAGS = 49152  # drapeaux Ff d'une case à cocher
+
+
+class TemplateField(NamedTuple):
+    name: str
+    page: int  # index de la page, à partir de 0
+    rect: Tuple[float, float, float, float]
+    type: str  # /Tx, /Btn, ...
+    flags: int
+
+    @property
+    def is_checkbox(self):
+        return self.type == PdfName.Btn and self.flags == CHECKBOX_FLAGS
+
+
+class CompiledTemplate:
+    """A parsed PDF form and the index of its fields.
+
+    The pdfrw objects are fully loaded once and shared: they must never be
+    modified. ``page_copy`` gives a page dictionary that is safe to change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = PdfReader(path)
+        self.reader.read_all()  # plus de chargement paresseux : lecture sûre entre threads
+        self.pages = self.reader.pages
+        self.fields: Dict[str, List[TemplateField]] = {}
+
+        # Un seul parcours des annotations, à la compilation
+        for page_index, page in enumerate(self.pages):
+            for annotation in page.Annots or []:
+                if annotation.Subtype != PdfName.Widget or annotation.T is None:
+                    continue
+                field = TemplateField(
+                    name=annotation.T.decode(),
+                    page=page_index,
+                    rect=tuple(float(value) for value in annotation.Rect),
+                    type=annotation.FT,
+                    flags=int(annotation.Ff or 0)
+                )
+                self.fields.setdefault(field.name, []).append(field)
+
+    def __repr__(self):
+        return f"CompiledTemplate(path='{self.path}', pages={len(self.pages)}, fields={len(self.fields)})"
+
+    def page_size(self, page_index):
+        media_box = self.pages[page_index].inheritable.MediaBox
+        return float(media_box[2]) - float(media_box[0]), float(media_box[3]) - float(media_box[1])
+
+    def fields_by_page(self, data_dict) -> Dict[int, List[Tuple[TemplateField, str]]]:
+        # Champs à remplir regroupés par page : seules ces pages reçoivent un calque
+        pages = {}
+        for name, value in data_dict.items():
+            for field in self.fields.get(name, ()):
+                pages.setdefault(field.page, []).append((field, value))
+        return pages
+
+    def page_copy(self, page_index):
+        # Nouvelle page sans champs de formulaire, attributs hérités recopiés, ressources
+        # dupliquées : PageMerge.render y ajoute ses XObjects sans toucher au modèle
+        page = self.pages[page_index]
+        inherited = page.inheritable
+        copy = PdfDict(page)
+        copy.Annots = None
+        copy.MediaBox = inherited.MediaBox
+        copy.CropBox = inherited.CropBox
+        copy.Rotate = inherited.Rotate
+        if inherited.Resources is not None:
+            resources = PdfDict(inherited.Resources)
+            if resources.XObject is not None:
+                resources.XObject = PdfDict(resources.XObject)
+            copy.Resources = resources
+        return copy
+
+
+@lru_cache(maxsize=4)
+def _compile_template(path, modified):
+    return CompiledTemplate(path)
+
+
+def load_template(path) -> CompiledTemplate:
+    # Compilé une fois par fichier ; recompilé si le modèle change sur le disque
+    return _compile_template(path, os.path.getmtime(path))
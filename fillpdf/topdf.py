@@ -1,75 +1,93 @@
-import pdfrw
-from pdfrw import PdfReader, PdfWriter, PageMerge, PdfName
+from pdfrw import PdfReader, PdfWriter, PageMerge
 from reportlab.pdfgen import canvas
 from io import BytesIO
+from fillpdf.template import load_template
+from tracing import span
+from concurrent.futures import ProcessPoolExecutor
 
 
-def fill_and_flatten_pdf(input_pdf_path, data_dict, output_pdf_path):
-    # Lire le PDF modèle
-    template_pdf = PdfReader(input_pdf_path)
-    
-    # Itérer sur chaque page
-    for page_number, page in enumerate(template_pdf.pages, start=1):
-        print(f"Processing page {page_number}")
-        # Dimensions de la page
-        media_box = page.MediaBox
-        page_width = float(media_box[2]) - float(media_box[0])
-        page_height = float(media_box[3]) - float(media_box[1])
-        
-        # Créer un PDF avec ReportLab pour cette page
-        packet = BytesIO()
-        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-        annotations = page.Annots
-        if annotations:
-            for annotation in annotations:
-                if annotation.Subtype == PdfName.Widget:
-                    field_name = annotation.get(PdfName.T)
-                    field_type = annotation.get(PdfName.FT)
-                    if field_name is not None:
-                        field_name_clean = field_name.strip('()')
-                        if field_name_clean in data_dict:
-                            print(field_name_clean)
-                            field_value = data_dict[field_name_clean]
-                            if field_type == PdfName.Btn and annotation.get(PdfName.Ff) == 49152:  # 49152 is the flag for checkboxes
-                                # Gérer les cases à cocher
-                                if str(field_value).lower() in ['yes', 'x', 'on', 'oui', 'true', '1']:
-                                    value = PdfName.Yes
-                                else:
-                                    value = PdfName.Off
-                                    print(value)
-                                annotation.update(
-                                    pdfrw.PdfDict(
-                                        V=value,
-                                        AS=value  # Update both the value and appearance state for checkboxes
-                                    )
-                                )
-                            else:
-                                # Gérer les champs de texte
-                                rect = annotation.Rect
-                                x1, y1, x2, y2 = [float(val) for val in rect]
-                                field_height = y2 - y1
-                                y = y1
-                                can.setFont("Helvetica", 10)
-                                can.drawString(x1 + 2, y + (field_height / 2) - 5, str(field_value))
-        can.showPage()       
+def fill_and_flatten_pdf(input_pdf_path, data_dict, output=None):
+    """Fill and flatten the form; returns the PDF as bytes.
+
+    ``output`` may also be a path or a writable binary stream, which then
+    receives the same bytes.
+    """
+    with span("fill_pdf") as trace:
+        pdf_bytes = _fill_and_flatten_pdf(input_pdf_path, data_dict)
+        trace.add(bytes=len(pdf_bytes))
+        trace.tag(fields=len(data_dict))
+
+    if hasattr(output, "write"):
+        output.write(pdf_bytes)
+    elif output is not None:
+        with open(output, "wb") as f:
+            f.write(pdf_bytes)
+    return pdf_bytes
+
+
+def _draw_overlay(template, fields_by_page):
+    # Un seul document ReportLab, une page par page remplie : la police et les
+    # ressources du calque sont partagées par toutes les pages fusionnées
+    packet = BytesIO()
+    can = canvas.Canvas(packet, pageCompression=1)
+    page_indexes = sorted(fields_by_page)
+    for page_index in page_indexes:
+        can.setPageSize(template.page_size(page_index))
+        can.setFont("Helvetica", 10)
+        for field, field_value in fields_by_page[page_index]:
+            if field.is_checkbox:
+                # L'état d'une case à cocher disparaît avec les champs du formulaire
+                continue
+            # Gérer les champs de texte
+            x1, y1, x2, y2 = field.rect
+            field_height = y2 - y1
+            can.drawString(x1 + 2, y1 + (field_height / 2) - 5, str(field_value))
         can.showPage()
-        can.save()
-
-        # Déplacer au début du buffer BytesIO
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        if overlay_pdf.pages:
-            overlay_page = overlay_pdf.pages[0]
-            PageMerge(page).add(overlay_page).render()
-        else:
-            print(f"No content to overlay on page {page_number}.")
-        
-        # Supprimer les champs de formulaire de la page
-        page.Annots = []
-
-    # Écrire le PDF rempli et aplati
-    PdfWriter().write(output_pdf_path, template_pdf)
-    print("Le PDF rempli et aplati a été enregistré.")
-
-# Appeler la fonction pour remplir et aplatir le PDF
-#fill_and_flatten_pdf(template_path, data, output_path)
+    can.save()
+
+    packet.seek(0)
+    return dict(zip(page_indexes, PdfReader(packet).pages))
+
+
+def _fill_and_flatten_pdf(input_pdf_path, data_dict):
+    # Modèle compilé une seule fois : pages analysées et index des champs
+    template = load_template(input_pdf_path)
+    fields_by_page = template.fields_by_page(data_dict)
+    overlays = _draw_overlay(template, fields_by_page) if fields_by_page else {}
+
+    # Flux non compressés du modèle et du calque compressés à l'écriture. pdfrw n'écrit pas
+    # de flux d'objets (PDF 1.5) ; sur docs/form.pdf les flux (images JPX surtout) font
+    # 2,88 des 2,89 Mo, les objets hors flux qu'ils regrouperaient pèsent moins de 1 %
+    writer = PdfWriter(compress=True)
+    for page_index in range(len(template.pages)):
+        # Nouvelle page sans les champs de formulaire ; le modèle partagé n'est jamais modifié
+        page = template.page_copy(page_index)
+        if page_index in overlays:
+            PageMerge(page).add(overlays[page_index]).render()
+        writer.addpage(page)
+
+    # PDF rempli et aplati, en mémoire
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _fill_worker(job):
+    input_pdf_path, data_dict, output = job
+    # Chaque processus compile le modèle à son premier formulaire puis le garde en cache
+    pdf_bytes = fill_and_flatten_pdf(input_pdf_path, data_dict, output)
+    return pdf_bytes if output is None else None
+
+
+def fill_many(input_pdf_path, data_dicts, outputs=None, max_workers=None):
+    """Fill many forms from one template across a process pool.
+
+    Returns the PDFs as bytes, in order; when ``outputs`` gives one path per
+    form, each PDF is written there instead and None is returned in its place.
+    """
+    outputs = outputs or [None] * len(data_dicts)
+    if len(outputs) != len(data_dicts):
+        raise ValueError("outputs must give one path per form")
+    jobs = [(input_pdf_path, data_dict, output) for data_dict, output in zip(data_dicts, outputs)]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=load_template, initargs=(input_pdf_path,)) as executor:
+        return list(executor.map(_fill_worker, jobs))
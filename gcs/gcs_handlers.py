@@ -4,8 +4,9 @@ import streamlit as st
 from pydub import AudioSegment
 import io
 from datetime import datetime
-import tempfile
-import os
+from transcribe.vad import trim_silence, offsets_blob_name
+from transcribe.codec import UPLOAD_CODEC, ARCHIVE_CODEC, ARCHIVE_PREFIX, upload_audio
+from tracing import span
 
 def check_gcs_permissions(bucket_name, credentials):
     try:
@@ -23,7 +24,9 @@ def check_gcs_permissions(bucket_name, credentials):
 def get_latest_gcs_files(bucket_name, credentials):
     storage_client = storage.Client(credentials=credentials)
     bucket = storage_client.bucket(bucket_name)
-    blobs = list(bucket.list_blobs())
+    # Ignorer les tables de correspondance et les copies d'archive
+    blobs = [blob for blob in bucket.list_blobs()
+             if not blob.name.endswith(".offsets.json") and not blob.name.startswith(ARCHIVE_PREFIX)]
     
     # Sort blobs by creation time, most recent first
     sorted_blobs = sorted(blobs, key=lambda x: x.time_created, reverse=True)
@@ -31,10 +34,31 @@ def get_latest_gcs_files(bucket_name, credentials):
     # Return the ten most recent files
     return [blob.name for blob in sorted_blobs[:6]]
 
-def process_and_upload_audio(audio_content, bucket_name, credentials):
+def upload_offset_map(bucket, filename, offset_map):
+    # La correspondance temps réduit -> temps d'appel accompagne l'audio téléversé
+    bucket.blob(offsets_blob_name(filename)).upload_from_string(offset_map.to_json(), content_type="application/json")
+
+def upload_archive_copy(bucket, filename, audio):
+    # Copie compacte de l'appel complet (par ex. Opus), si un codec d'archive est configuré
+    if ARCHIVE_CODEC is not None:
+        upload_audio(bucket, f"{ARCHIVE_PREFIX}{filename}.{ARCHIVE_CODEC.extension}", audio, ARCHIVE_CODEC)
+
+def process_and_upload_audio(audio_content, bucket_name, credentials, remove_silence=True, codec=UPLOAD_CODEC):
+    with span("upload_audio") as trace:
+        return _process_and_upload_audio(audio_content, bucket_name, credentials, remove_silence, codec, trace)
+
+def _process_and_upload_audio(audio_content, bucket_name, credentials, remove_silence, codec, trace):
     # Split stereo audio
     audio = AudioSegment.from_wav(io.BytesIO(audio_content))
+    trace.add(audio_seconds=audio.duration_seconds)
     channels = audio.split_to_mono()
+
+    # Retirer les silences communs aux deux canaux avant l'envoi (mêmes coupes partout)
+    if remove_silence:
+        trimmed, offset_map = trim_silence(audio)
+        upload_channels = trimmed.split_to_mono()
+    else:
+        upload_channels, offset_map = channels, None
     
     current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
     
@@ -43,22 +67,48 @@ def process_and_upload_audio(audio_content, bucket_name, credentials):
     
     gcs_uris = []
     
-    for i, channel in enumerate(channels):
+    for i, channel in enumerate(upload_channels):
         speaker = "caller" if i == 0 else "receiver"
-        filename = f"{speaker}_{current_datetime}.wav"
-        
-        # Use tempfile to create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            temp_path = temp_file.name
-            channel.export(temp_path, format="wav")
+        filename = f"{speaker}_{current_datetime}.{codec.extension}"
         
-        # Upload to GCS
-        blob = bucket.blob(filename)
-        blob.upload_from_filename(temp_path)
+        # Encode in memory and upload to GCS, with the encoding descriptor as metadata
+        blob = upload_audio(bucket, filename, channel, codec)
+        trace.add(bytes=blob.size)
+        if offset_map is not None:
+            upload_offset_map(bucket, filename, offset_map)
         
         gcs_uris.append(f"gs://{bucket_name}/{filename}")
-        
-        # Clean up temporary file
-        os.unlink(temp_path)
+
+    upload_archive_copy(bucket, f"call_{current_datetime}", audio)
     
+    # Les canaux complets restent en session : les temps des mots sont ramenés au temps d'appel
     return gcs_uris, channels
+
+def upload_stereo_audio(audio_content, bucket_name, credentials, remove_silence=True, codec=UPLOAD_CODEC):
+    with span("upload_audio") as trace:
+        return _upload_stereo_audio(audio_content, bucket_name, credentials, remove_silence, codec, trace)
+
+def _upload_stereo_audio(audio_content, bucket_name, credentials, remove_silence, codec, trace):
+    # Téléverser l'enregistrement stéréo en un seul objet, sans découpage par canal
+    current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"call_{current_datetime}.{codec.extension}"
+    
+    storage_client = storage.Client(credentials=credentials)
+    bucket = storage_client.bucket(bucket_name)
+
+    audio = AudioSegment.from_wav(io.BytesIO(audio_content))
+    trace.add(audio_seconds=audio.duration_seconds)
+    if remove_silence:
+        trimmed, offset_map = trim_silence(audio)
+        blob = upload_audio(bucket, filename, trimmed, codec)
+        upload_offset_map(bucket, filename, offset_map)
+    else:
+        blob = upload_audio(bucket, filename, audio, codec)
+    trace.add(bytes=blob.size)
+
+    upload_archive_copy(bucket, f"call_{current_datetime}", audio)
+    
+    # Les canaux décodés restent nécessaires localement pour la lecture des extraits
+    channels = audio.split_to_mono()
+    
+    return f"gs://{bucket_name}/{filename}", channels
@@ -0,0 +1,202 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, NamedTuple, Optional
+from tracing import span
+from disk_cache import DiskCache
+import contextvars
+import hashlib
+import json
+import os
+import queue
+
+DEFAULT_MODEL = "claude-3-5-sonnet-20240620"
+MAX_TOKENS = 8192
+SUMMARY_MAX_TOKENS = 1024  # résumé de 1 à 2 paragraphes
+# Requêtes simultanées au plus vers l'API, pour rester sous les limites de débit
+MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+DEFAULT_CACHE_DIR = os.path.join("cache", "llm")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64 Mo
+
+
+class LLMResponse(NamedTuple):
+    text: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    stop_reason: Optional[str] = None
+    cached: bool = False  # True si la réponse vient du cache local, sans appel à l'API
+
+
+class StreamEvent(NamedTuple):
+    name: str  # requête d'origine
+    text: str = ""  # texte reçu depuis l'événement précédent
+    response: Optional[LLMResponse] = None  # réponse complète : dernier événement de la requête
+    error: Optional[Exception] = None  # échec de la requête : dernier événement aussi
+
+
+def prompt_parts(template, dynamic_field, **values):
+    """Split a prompt template into its static prefix and the rest.
+
+    Everything before ``{dynamic_field}`` (instructions, and the transcript
+    shared by the form sections) is the same from one call to the next and is
+    marked for Anthropic's prompt cache.
+    """
+    head, tail = template.split("{" + dynamic_field + "}", 1)
+    return head.format(**values), ("{" + dynamic_field + "}" + tail).format(**values)
+
+
+def response_key(model, max_tokens, prefix, suffix):
+    payload = json.dumps([model, max_tokens, prefix, suffix], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(DiskCache):
+    """Persistent store of model responses, bounded in size with LRU eviction.
+
+    Each entry is a JSON file named after its key (model and prompt hash).
+    """
+
+    suffix = ".json"
+    read_errors = (FileNotFoundError, json.JSONDecodeError, TypeError)
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def load(self, path) -> LLMResponse:
+        with open(path, "r", encoding="utf-8") as f:
+            return LLMResponse(**json.load(f))
+
+    def dump(self, response: LLMResponse, f):
+        f.write(json.dumps(response._replace(cached=False)._asdict(), ensure_ascii=False).encode("utf-8"))
+
+
+response_cache = ResponseCache()
+
+
+def trace_usage(trace, usage, model):
+    trace.add(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+    # Jetons du préfixe écrits dans le cache d'Anthropic, ou relus depuis celui-ci
+    trace.tag(model=model,
+              cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+              cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0)
+
+
+class LLMClient:
+    """Claude calls with a local response cache and a cached prompt prefix.
+
+    The Anthropic client is created on first use unless one is given, so a
+    stub exposing ``messages.create`` (and ``messages.stream`` for
+    streamed calls) can stand in for it.
+    """
+
+    def __init__(self, client=None, cache=response_cache, model=DEFAULT_MODEL, max_tokens=MAX_TOKENS):
+        self._client = client
+        self.cache = cache
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def __repr__(self):
+        return f"LLMClient(model='{self.model}', max_tokens={self.max_tokens})"
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import Anthropic
+            self._client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return self._client
+
+    def messages(self, prefix, suffix):
+        # Le préfixe statique est mis en cache côté Anthropic ; seule la suite est relue à chaque appel
+        content = []
+        if prefix:
+            content.append({"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}})
+        if suffix:
+            content.append({"type": "text", "text": suffix})
+        return [{"role": "user", "content": content}]
+
+    def complete(self, prefix, suffix="", stage="llm", refresh=False, max_tokens=None,
+                 on_text: Optional[Callable[[str], None]] = None) -> LLMResponse:
+        """Response to the prompt ``prefix + suffix``, from the local cache when possible.
+
+        With ``on_text`` the response is streamed and each piece of text is
+        passed to it as it arrives. ``refresh`` skips the cache lookup and
+        replaces the stored response.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        key = response_key(self.model, max_tokens, prefix, suffix)
+        with span(stage) as trace:
+            cached = None if refresh or self.cache is None else self.cache.get(key)
+            if cached is not None:
+                trace.tag(model=cached.model, cached=True)
+                if on_text is not None:
+                    on_text(cached.text)
+                return cached._replace(cached=True)
+
+            params = dict(model=self.model, max_tokens=max_tokens, messages=self.messages(prefix, suffix))
+            if on_text is None:
+                response = self.client.messages.create(**params)
+            else:
+                with self.client.messages.stream(**params) as stream:
+                    for text in stream.text_stream:
+                        on_text(text)
+                    response = stream.get_final_message()
+            trace_usage(trace, response.usage, response.model)
+
+        result = LLMResponse(
+            text="".join(block.text for block in response.content if block.type == "text"),
+            model=response.model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            stop_reason=response.stop_reason
+        )
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return result
+
+    def stream_many(self, requests: Dict[str, dict], max_workers=MAX_CONCURRENT_REQUESTS) -> Iterator[StreamEvent]:
+        """Run several requests concurrently and yield their text as it arrives.
+
+        ``requests`` maps a name to the arguments of ``complete``; at most
+        ``max_workers`` run at once, started in the order given. Requests
+        sharing a prefix wait until the first of them starts streaming, so
+        they read that prefix from Anthropic's cache instead of each paying
+        for writing it. Events are yielded in arrival order from the calling
+        thread; each request ends with one event carrying its response or
+        its error.
+        """
+        events = queue.Queue()
+
+        def run(name, arguments):
+            try:
+                response = self.complete(on_text=lambda text: events.put(StreamEvent(name, text)), **arguments)
+                events.put(StreamEvent(name, response=response))
+            except Exception as e:
+                events.put(StreamEvent(name, error=e))
+
+        # Premier de chaque préfixe commun -> requêtes qui attendent son premier événement
+        leaders = {}
+        held = {}
+        for name, arguments in requests.items():
+            prefix = arguments.get("prefix")
+            if prefix and prefix in leaders:
+                held.setdefault(leaders[prefix], []).append(name)
+            elif prefix:
+                leaders[prefix] = name
+        waiting = {name for names in held.values() for name in names}
+
+        with ThreadPoolExecutor(max_workers=max(min(len(requests), max_workers), 1)) as executor:
+            def submit(name):
+                # Chaque requête garde l'enregistrement courant pour ses étapes tracées
+                executor.submit(contextvars.copy_context().run, run, name, requests[name])
+
+            for name in requests:
+                if name not in waiting:
+                    submit(name)
+            pending = len(requests)
+            while pending:
+                event = events.get()
+                # Le flux du premier a commencé (ou il a échoué) : préfixe en cache
+                for name in held.pop(event.name, []):
+                    submit(name)
+                if event.response is not None or event.error is not None:
+                    pending -= 1
+                yield event
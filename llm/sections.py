@@ -0,0 +1,76 @@
+from typing import Any, Dict, List, NamedTuple
+from llm.llm_handlers import prompt_parts
+from utils import extract_form_with_confidence
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECTIONS_PATH = "docs/form_sections.json"
+SECTION_PREFIX = "form."  # nom des requêtes de section dans stream_many
+
+
+class FormSection(NamedTuple):
+    name: str
+    text: str  # lignes du formulaire de la section, telles que dans form_short.txt
+
+    @property
+    def request_name(self):
+        return SECTION_PREFIX + self.name
+
+
+def split_form(form_text, config) -> List[FormSection]:
+    """Split the form into the sections of ``config``, in form order.
+
+    Each section starts at the line given by its ``starts_with`` and runs up
+    to the next section; lines before the first one belong to it.
+    """
+    lines = form_text.split("\n")
+    stripped = [line.strip() for line in lines]
+    starts = []
+    for spec in config["sections"]:
+        if spec["starts_with"] not in stripped:
+            raise ValueError(f"Form section '{spec['name']}' starts at an unknown field: {spec['starts_with']}")
+        starts.append(stripped.index(spec["starts_with"]))
+    if starts != sorted(starts):
+        raise ValueError("Form sections must be listed in form order")
+
+    starts[0] = 0
+    ends = starts[1:] + [len(lines)]
+    return [FormSection(spec["name"], "\n".join(lines[start:end]).strip("\n"))
+            for spec, start, end in zip(config["sections"], starts, ends)]
+
+
+def load_sections(form_text, path=DEFAULT_SECTIONS_PATH) -> List[FormSection]:
+    with open(path, "r", encoding="utf-8") as f:
+        return split_form(form_text, json.load(f))
+
+
+def section_requests(sections, prompt_template, transcript, stage="llm.form") -> Dict[str, dict]:
+    # Une requête par section, sur la même transcription ; arguments de LLMClient.complete.
+    # La transcription précède le formulaire dans le gabarit : instructions et transcription
+    # forment le préfixe mis en cache, commun à toutes les sections
+    requests = {}
+    for section in sections:
+        prefix, suffix = prompt_parts(prompt_template, "form", form=section.text, transcript=transcript)
+        requests[section.request_name] = dict(prefix=prefix, suffix=suffix, stage=f"{stage}.{section.name}")
+    return requests
+
+
+def merge_sections(sections, texts: Dict[str, str]) -> Dict[str, Any]:
+    """Merge the section responses into one {field: {réponse, confiance}} form.
+
+    Fields keep the form order. A section whose response is missing or
+    holds no JSON contributes no field instead of failing the whole form.
+    """
+    form = {}
+    for section in sections:
+        text = texts.get(section.request_name)
+        if not text:
+            continue
+        try:
+            form.update(extract_form_with_confidence(text))
+        except ValueError as e:
+            logger.warning(f"Section {section.name} ignored: {e}")
+    return form
+
@@ -3,6 +3,7 @@ import requests
 import base64
 import json
 import streamlit as st
+from tracing import span
 salesforce_credentials = {
     "client_id": os.getenv("SF_CLIENT_ID"),
     "client_secret": os.getenv("SF_CLIENT_SECRET"),
@@ -14,6 +15,11 @@ salesforce_credentials = {
     "refresh_token": os.getenv("SF_REFRESH_TOKEN")#no need for this later if we use auth link and get auth code redirect later on
     }
 
+def trace_response(trace, response):
+    # Octets envoyés et reçus par la requête, et son statut HTTP
+    trace.add(bytes=len(response.request.body or b"") + len(response.content))
+    trace.tag(http_status=response.status_code)
+
 def request_access_token_using_refresh_token(refresh_token):
     token_data = {
         "grant_type": "refresh_token",
@@ -40,7 +46,9 @@ def create_account(access_token, instance_url):
         'Content-Type': 'application/json'
     }
     account_url = f"{instance_url}/services/data/v61.0/sobjects/Account/"
-    response = requests.post(account_url, headers=headers, json=account_details)
+    with span("salesforce.account") as trace:
+        response = requests.post(account_url, headers=headers, json=account_details)
+        trace_response(trace, response)
     if response.status_code == 201:
         account_id = response.json()['id']
         st.success(f"Account created successfully! ID: {account_id}")
@@ -57,7 +65,9 @@ def create_opportunity(access_token, account_id, instance_url):
     }
     opportunity_url = f"{instance_url}/services/data/v60.0/sobjects/Opportunity/"
     
-    response = requests.post(opportunity_url, headers=headers, json=opportunity_details)
+    with span("salesforce.opportunity") as trace:
+        response = requests.post(opportunity_url, headers=headers, json=opportunity_details)
+        trace_response(trace, response)
     if response.status_code == 201:
         opportunity_id = response.json()['id']
         st.success(f"Opportunity created successfully! ID: {opportunity_id}")
@@ -79,7 +89,9 @@ def add_note_to_account(access_token, account_id, instance_url):
     }
     note_url =  f"{instance_url}/services/data/v60.0/sobjects/Note/"
     
-    response = requests.post(note_url, headers=headers, json=note_details)
+    with span("salesforce.note") as trace:
+        response = requests.post(note_url, headers=headers, json=note_details)
+        trace_response(trace, response)
     if response.status_code == 201:
         note_id = response.json()['id']
         st.success(f"Note added successfully! ID: {note_id}")
@@ -87,31 +99,39 @@ def add_note_to_account(access_token, account_id, instance_url):
     else:
         st.error(f"Failed to add note: {response.text}")
         return None
-def upload_file_to_account(access_token, file_path, account_id, instance_url):
+def upload_file_to_account(access_token, file, account_id, instance_url, file_name=None):
+    # file : contenu du fichier (bytes) ou chemin sur le disque
     headers = {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
     
-    with open(file_path, 'rb') as f:
-        file_data = f.read()
-        base64_file_data = base64.b64encode(file_data).decode('utf-8')
-        
-        content_version_data = {
-            'Title': os.path.basename(file_path),
-            'PathOnClient': os.path.basename(file_path),
-            'VersionData': base64_file_data,
-            'FirstPublishLocationId': account_id
-        }
-        
-        content_version_url = f"{instance_url}/services/data/v60.0/sobjects/ContentVersion/"
-        
+    if isinstance(file, (bytes, bytearray)):
+        file_data = file
+        file_name = file_name or "filled_form.pdf"
+    else:
+        with open(file, 'rb') as f:
+            file_data = f.read()
+        file_name = file_name or os.path.basename(file)
+    base64_file_data = base64.b64encode(file_data).decode('utf-8')
+    
+    content_version_data = {
+        'Title': file_name,
+        'PathOnClient': file_name,
+        'VersionData': base64_file_data,
+        'FirstPublishLocationId': account_id
+    }
+    
+    content_version_url = f"{instance_url}/services/data/v60.0/sobjects/ContentVersion/"
+    
+    with span("salesforce.file") as trace:
         response = requests.post(content_version_url, headers=headers, json=content_version_data)
-        if response.status_code == 201:
-            content_version_id = response.json()['id']
-            st.success(f"File uploaded successfully! ContentVersion ID: {content_version_id}")
-        else:
-            st.error(f"Failed to upload file: {response.text}")
+        trace_response(trace, response)
+    if response.status_code == 201:
+        content_version_id = response.json()['id']
+        st.success(f"File uploaded successfully! ContentVersion ID: {content_version_id}")
+    else:
+        st.error(f"Failed to upload file: {response.text}")
 
 
 #helpers function to get details from json file 
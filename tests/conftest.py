@@ -0,0 +1,11 @@
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def trace_log(tmp_path, monkeypatch):
+    # Les étapes tracées pendant les tests n'alimentent pas le journal réel (/metrics)
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_LOG_PATH", str(path))
+    return path
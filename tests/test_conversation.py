@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import pytest
+
+from transcribe.conversation import (
+    CONFIDENCE_MARK, UNMARKED_CONFIDENCE, ConversationBuilder, mark_low_confidence, merge_conversation
+)
+
+
+def random_channels(rng, channel_count, word_count):
+    # Mots numérotés dans l'ordre d'émission, chaque canal en ordre de temps
+    words = [[] for _ in range(channel_count)]
+    clock = [0.0] * channel_count
+    for i in range(word_count):
+        c = rng.randrange(channel_count)
+        start = clock[c] + rng.choice([0.05, 0.1, 0.3, 0.5, 1.0])
+        end = start + rng.choice([0.1, 0.2, 0.4])
+        clock[c] = end
+        words[c].append({"word": f"w{i:03d}", "start_time": start, "end_time": end, "confidence": 0.9})
+    return words
+
+
+def streamed_results(rng, words):
+    # Résultats de 1 à 4 mots par canal, entrelacés au hasard entre canaux
+    queues = []
+    for channel_words in words:
+        results = []
+        k = 0
+        while k < len(channel_words):
+            chunk = channel_words[k:k + rng.randint(1, 4)]
+            results.append({"results": [{"alternatives": [{"transcript": "", "confidence": 0.9, "words": chunk}]}]})
+            k += len(chunk)
+        queues.append(results)
+    while any(queues):
+        channel = rng.choice([c for c, results in enumerate(queues) if results])
+        yield channel, queues[channel].pop(0)
+
+
+@pytest.mark.parametrize("channel_count,seed", [(2, 0), (3, 0), (3, 1), (4, 2)])
+def test_builder_matches_merge_conversation(channel_count, seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        words = random_channels(rng, channel_count, rng.randint(2, 30))
+        builder = ConversationBuilder(channel_count=channel_count)
+        for channel, transcript in streamed_results(rng, words):
+            last = transcript["results"][0]["alternatives"][0]["words"][-1]
+            builder.add_words(channel, transcript, until=last["end_time"])
+
+        expected = merge_conversation([{"results": [{"alternatives": [{"words": w}]}]} for w in words])
+        assert builder.finish() == expected
+
+
+def word_results(*words):
+    return {"results": [{"alternatives": [{"words": [
+        {"word": w, "start_time": t, "end_time": t + 0.2, "confidence": 0.9} for w, t in words]}]}]}
+
+
+def test_advance_unblocks_silent_channel():
+    caller = [word_results(("allô", 0.0)), word_results(("oui", 4.0)), word_results(("voilà", 8.0))]
+    receiver = [word_results(("bonjour", 2.0)), word_results(("merci", 6.0))]
+    builder = ConversationBuilder(channel_count=2)
+    for transcript_0, transcript_1 in zip(caller, receiver):
+        builder.add_words(0, transcript_0)
+        builder.add_words(1, transcript_1)
+    builder.add_words(0, caller[2], until=20.0)
+
+    # Le destinataire se tait : sans avancer son canal, rien après 6 s n'est acquis
+    blocked = len(builder.finalized_lines)
+    builder.advance(1, 20.0)
+    assert len(builder.finalized_lines) > blocked
+    assert builder.finish() == merge_conversation([
+        {"results": [r["results"][0] for r in caller]},
+        {"results": [r["results"][0] for r in receiver]},
+    ])
+
+
+def compact_scores(words, confidence):
+    # Confiances que le modèle rend pour des mots au format compact
+    marked = mark_low_confidence(words, confidence)
+    return [int(token[-1]) / 10 if token[-2:-1] == CONFIDENCE_MARK else UNMARKED_CONFIDENCE
+            for token in marked]
+
+
+def flagged(confidence):
+    # Mêmes seuils que validate_form
+    return sum(confidence) / len(confidence) < 0.5 or min(confidence) < 0.1
+
+
+def test_compact_confidences_never_hide_a_flag():
+    assert flagged(compact_scores(["a", "b"], [0.72, 0.2]))
+
+    rng = random.Random(0)
+    for _ in range(5000):
+        # Confiances stockées en float32, affichées au centième dans le format complet
+        confidence = np.float32([rng.random() for _ in range(rng.randint(1, 4))])
+        full = [float(score) for score in np.char.mod('%.2f', confidence.astype(np.float64))]
+        compact = compact_scores(["mot"] * len(confidence), confidence)
+        assert all(c <= f for c, f in zip(compact, full))
+        assert (min(compact) < 0.1) == (min(full) < 0.1)
+        if flagged(full):
+            assert flagged(compact)
@@ -0,0 +1,123 @@
+import os
+import time
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+from llm.llm_handlers import LLMClient, LLMResponse, ResponseCache
+
+
+class StubMessages:
+    # Tient lieu de client.messages d'Anthropic : enregistre les appels, répond "réponse N"
+    def __init__(self):
+        self.calls = []
+        self.log = []
+        self.delays = {}  # suffixe -> secondes avant le premier texte
+
+    def create(self, **params):
+        self.calls.append(params)
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=f"réponse {len(self.calls)}")],
+            model=params["model"],
+            usage=SimpleNamespace(input_tokens=100, output_tokens=10,
+                                  cache_creation_input_tokens=0, cache_read_input_tokens=0),
+            stop_reason="end_turn",
+        )
+
+    def stream(self, **params):
+        # Flux d'un seul morceau ; log note le début de chaque requête et son premier texte
+        suffix = params["messages"][0]["content"][-1]["text"]
+        self.log.append(("début", suffix))
+        response = self.create(**params)
+
+        def text_stream():
+            time.sleep(self.delays.get(suffix, 0))
+            self.log.append(("texte", suffix))
+            yield response.content[0].text
+
+        return nullcontext(SimpleNamespace(text_stream=text_stream(), get_final_message=lambda: response))
+
+
+def stub_client(tmp_path):
+    messages = StubMessages()
+    cache = ResponseCache(str(tmp_path / "llm"))
+    return LLMClient(client=SimpleNamespace(messages=messages), cache=cache), messages
+
+
+def test_cache_hit_skips_api_call(tmp_path, trace_log):
+    client, messages = stub_client(tmp_path)
+    first = client.complete("Instructions\n", "Transcription")
+    second = client.complete("Instructions\n", "Transcription")
+
+    assert len(messages.calls) == 1
+    assert not first.cached and second.cached
+    assert second.text == first.text == "réponse 1"
+    # Une étape tracée par appel, dans le journal du test
+    assert len(trace_log.read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_refresh_overwrites_cached_response(tmp_path):
+    client, messages = stub_client(tmp_path)
+    client.complete("Instructions\n", "Transcription")
+    refreshed = client.complete("Instructions\n", "Transcription", refresh=True)
+
+    assert len(messages.calls) == 2
+    assert refreshed.text == "réponse 2"
+    assert client.complete("Instructions\n", "Transcription").text == "réponse 2"
+    assert len(messages.calls) == 2
+
+
+def test_prefix_block_is_cache_controlled(tmp_path):
+    client, messages = stub_client(tmp_path)
+    client.complete("Instructions\n", "Transcription")
+
+    prefix_block, suffix_block = messages.calls[0]["messages"][0]["content"]
+    assert prefix_block == {"type": "text", "text": "Instructions\n", "cache_control": {"type": "ephemeral"}}
+    assert suffix_block == {"type": "text", "text": "Transcription"}
+
+
+def test_eviction_keeps_recent_entries_under_max_bytes(tmp_path):
+    cache = ResponseCache(str(tmp_path / "llm"))
+    response = LLMResponse(text="x" * 100, model="stub", input_tokens=1, output_tokens=1)
+    for i in range(10):
+        cache.put(f"key{i}", response)
+        # Temps d'accès distincts : l'ordre LRU ne dépend pas de la résolution du système de fichiers
+        os.utime(cache._path(f"key{i}"), (i, i))
+    entry_size = os.path.getsize(cache._path("key0"))
+    cache.get("key0")  # relue : la plus récemment utilisée
+
+    cache.max_bytes = 4 * entry_size
+    cache.put("key10", response)
+
+    assert sum(entry.stat().st_size for entry in os.scandir(cache.directory)) <= cache.max_bytes
+    assert sorted(entry.name for entry in os.scandir(cache.directory)) == \
+        ["key0.json", "key10.json", "key8.json", "key9.json"]
+
+
+def test_entry_evicted_after_load_is_still_a_hit(tmp_path):
+    cache = ResponseCache(str(tmp_path / "llm"))
+    response = LLMResponse(text="x", model="stub", input_tokens=1, output_tokens=1)
+    cache.put("key", response)
+
+    # Éviction par un put concurrent entre la lecture et la mise à jour de l'accès
+    load = cache.load
+    def load_then_evict(path):
+        value = load(path)
+        os.remove(path)
+        return value
+    cache.load = load_then_evict
+
+    assert cache.get("key") == response
+
+
+def test_requests_sharing_a_prefix_wait_for_the_first_stream(tmp_path):
+    client, messages = stub_client(tmp_path)
+    requests = {f"section {i}": dict(prefix="Transcription\n", suffix=f"Section {i}") for i in range(3)}
+    requests["résumé"] = dict(prefix="Résumé\n", suffix="Résumé")
+    messages.delays["Section 0"] = 0.1
+    events = list(client.stream_many(requests, max_workers=4))
+
+    assert sum(event.response is not None for event in events) == 4
+    # Les autres sections ne commencent qu'une fois le préfixe écrit dans le cache par la première
+    first_text = messages.log.index(("texte", "Section 0"))
+    assert messages.log.index(("début", "Section 1")) > first_text
+    assert messages.log.index(("début", "Section 2")) > first_text
@@ -0,0 +1,131 @@
+import base64
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+from transcribe.conversation import merge_conversation
+from twiliohelpers.media_stream import (
+    BYTES_PER_SECOND, MediaStreamSession, load_live_conversation, load_live_transcripts, mark_answered,
+    run_media_stream
+)
+
+CALL_SID = "CA0123456789"
+SILENCE = base64.b64encode(b"\xff" * 160).decode("ascii")  # 20 ms de silence μ-law
+
+
+class FakeWebSocket:
+    # Rejoue des messages Twilio, puis se comporte comme une connexion fermée
+    def __init__(self, messages):
+        self.messages = [json.dumps(message) for message in messages]
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+
+class FakeRecognizer:
+    # Consomme tout l'audio de la piste, puis rend ses mots (temps relatifs au début du flux)
+    def __init__(self, words):
+        self.words = words
+        self.audio_bytes = 0
+
+    def stream(self, audio_chunks):
+        for chunk in audio_chunks:
+            self.audio_bytes += len(chunk)
+        for word, start, end in self.words:
+            yield SimpleNamespace(alternatives=[SimpleNamespace(
+                transcript=word, confidence=0.9,
+                words=[SimpleNamespace(word=word, start_time=timedelta(seconds=start),
+                                       end_time=timedelta(seconds=end), confidence=0.9)]
+            )])
+
+
+def media(track, timestamp):
+    return {"event": "media", "media": {"track": track, "timestamp": str(timestamp), "payload": SILENCE}}
+
+
+def run_call(tmp_path, messages, recognizers):
+    session = MediaStreamSession(lambda: recognizers.pop(0), store_dir=str(tmp_path))
+    run_media_stream(FakeWebSocket(messages), session)
+    return session
+
+
+def test_session_saves_transcripts_and_conversation(tmp_path):
+    caller = FakeRecognizer([("bonjour", 0.1, 0.5), ("merci", 2.0, 2.4)])
+    receiver = FakeRecognizer([("oui", 0.2, 0.4)])
+    # La piste sortante commence une seconde après la piste entrante
+    messages = [{"event": "start", "start": {"callSid": CALL_SID}}]
+    messages += [media("inbound", 20 * i) for i in range(150)]
+    messages += [media("outbound", 1000 + 20 * i) for i in range(100)]
+    messages += [{"event": "stop"}]
+    run_call(tmp_path, messages, [caller, receiver])
+
+    transcripts = load_live_transcripts(CALL_SID, str(tmp_path))
+    caller_words = [w for r in transcripts[0]["results"] for w in r["alternatives"][0]["words"]]
+    receiver_words = [w for r in transcripts[1]["results"] for w in r["alternatives"][0]["words"]]
+    assert [w["word"] for w in caller_words] == ["bonjour", "merci"]
+    assert [(w["word"], w["start_time"], w["end_time"]) for w in receiver_words] == [("oui", 1.2, 1.4)]
+
+    conversation = load_live_conversation(CALL_SID, str(tmp_path))
+    assert conversation == merge_conversation(transcripts)
+    assert conversation.split("\n")[::2] == ["Caller: bonjour", "Receiver: oui", "Caller: merci"]
+
+
+def test_dropped_frames_are_padded_with_silence(tmp_path):
+    caller = FakeRecognizer([("allô", 0.5, 0.7)])
+    # Trames de 60 à 100 ms perdues : le mot reste au temps de l'appel
+    messages = [{"event": "start", "start": {"callSid": CALL_SID}}]
+    messages += [media("inbound", t) for t in (0, 20, 40, 100, 120)]
+    run_call(tmp_path, messages, [caller])
+
+    assert caller.audio_bytes == 0.14 * BYTES_PER_SECOND
+    transcripts = load_live_transcripts(CALL_SID, str(tmp_path))
+    assert transcripts[0]["results"][0]["alternatives"][0]["words"][0]["start_time"] == 0.5
+    assert transcripts[1] == {"results": []}
+
+
+def test_times_count_from_the_answer(tmp_path):
+    # Message d'accueil et sonnerie avant le décroché, à 1 s : l'enregistrement commence là
+    caller = FakeRecognizer([("patientez", 0.2, 0.6), ("bonjour", 1.5, 1.9)])
+    receiver = FakeRecognizer([("allô", 0.2, 0.4)])  # piste sortante ouverte au décroché
+    recognizers = [caller, receiver]
+    session = MediaStreamSession(lambda: recognizers.pop(0), store_dir=str(tmp_path))
+    session.handle_message({"event": "start", "start": {"callSid": CALL_SID}})
+    for i in range(50):
+        session.handle_message(media("inbound", 20 * i))
+    assert mark_answered(CALL_SID)
+    for i in range(50, 100):
+        session.handle_message(media("inbound", 20 * i))
+        session.handle_message(media("outbound", 20 * i))
+    session.close()
+
+    transcripts = load_live_transcripts(CALL_SID, str(tmp_path))
+    words = [[(w["word"], round(w["start_time"], 3)) for r in t["results"] for w in r["alternatives"][0]["words"]]
+             for t in transcripts]
+    assert words == [[("bonjour", 0.5)], [("allô", 0.2)]]
+    assert load_live_conversation(CALL_SID, str(tmp_path)) == merge_conversation(transcripts)
+    assert not mark_answered(CALL_SID)  # session fermée
+
+
+def result(word, start):
+    return {"alternatives": [{"transcript": word, "confidence": 0.9, "words": [
+        {"word": word, "start_time": start, "end_time": start + 0.3, "confidence": 0.9}]}]}
+
+
+def test_saves_only_append_during_the_call(tmp_path):
+    session = MediaStreamSession(lambda: None, store_dir=str(tmp_path))
+    session.handle_message({"event": "start", "start": {"callSid": CALL_SID}})
+    session.mark_answered(0.0)
+    for i, (channel, word) in enumerate([(0, "allô"), (1, "bonjour"), (0, "oui"), (1, "merci"), (0, "voilà")]):
+        session._on_result(channel, result(word, 2.0 * i))
+
+    # Avant la fin : le journal des résultats et les seuls tours finalisés
+    with open(tmp_path / f"{CALL_SID}.txt", encoding="utf-8") as f:
+        assert f.read() == session.builder.finalized_text != ""
+    assert load_live_conversation(CALL_SID, str(tmp_path)) is None
+    in_call = load_live_transcripts(CALL_SID, str(tmp_path))
+    assert [len(transcript["results"]) for transcript in in_call] == [3, 2]
+
+    session.close()
+    assert not (tmp_path / f"{CALL_SID}.jsonl").exists()
+    assert load_live_transcripts(CALL_SID, str(tmp_path)) == in_call
+    assert load_live_conversation(CALL_SID, str(tmp_path)) == merge_conversation(in_call)
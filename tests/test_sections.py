@@ -0,0 +1,27 @@
+from llm.sections import load_sections, merge_sections, section_requests
+
+TEMPLATE = "Instructions\n\nTranscription:\n\n{transcript}\n\nForm:\n\n{form}\n\nAssistant:"
+
+
+def form_sections():
+    with open("docs/form_short.txt", "r", encoding="utf-8") as f:
+        return load_sections(f.read())
+
+
+def test_sections_share_the_transcript_prefix():
+    sections = form_sections()
+    requests = section_requests(sections, TEMPLATE, "Caller: bonjour")
+
+    prefixes = {request["prefix"] for request in requests.values()}
+    assert prefixes == {"Instructions\n\nTranscription:\n\nCaller: bonjour\n\nForm:\n\n"}
+    assert [request["suffix"] for request in requests.values()] == \
+        [f"{section.text}\n\nAssistant:" for section in sections]
+
+
+def test_merge_sections_skips_unparsable_responses():
+    sections = form_sections()[:2]
+    texts = {
+        sections[0].request_name: '{"Nom": {"réponse": "Tremblay", "confiance": [0.9]}}',
+        sections[1].request_name: "pas de JSON",
+    }
+    assert merge_sections(sections, texts) == {"Nom": {"réponse": "Tremblay", "confiance": [0.9]}}
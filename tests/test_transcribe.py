@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+from transcribe import transcribe
+from transcribe.words import WordTable
+
+GCS_URI = "gs://bucket/call.flac"
+
+
+class StubSpeechClient:
+    # Reconnaissance longue sans résultat, qui enregistre ses appels
+    def __init__(self, calls):
+        self.calls = calls
+
+    def long_running_recognize(self, config, audio):
+        self.calls.append(audio)
+        return SimpleNamespace(result=lambda timeout: SimpleNamespace(results=[], total_billed_time=None))
+
+
+@pytest.fixture
+def speech_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(transcribe, "recognition_config_for", lambda gcs_uri, credentials: None)
+    monkeypatch.setattr(transcribe.speech, "SpeechClient", lambda credentials: StubSpeechClient(calls))
+    return calls
+
+
+def test_offset_map_error_propagates_before_recognition(monkeypatch, speech_calls):
+    def unreadable(gcs_uri, credentials):
+        raise PermissionError("metadata")
+    monkeypatch.setattr(transcribe, "load_offset_map", unreadable)
+
+    with pytest.raises(PermissionError):
+        transcribe.transcribe_gcs_large(GCS_URI, credentials=None, cache=None)
+    assert speech_calls == []
+
+
+def test_unreadable_response_raises(monkeypatch, speech_calls):
+    monkeypatch.setattr(transcribe, "load_offset_map", lambda gcs_uri, credentials: None)
+
+    def broken(results, channel=0):
+        raise ValueError("bad response")
+    monkeypatch.setattr(WordTable, "from_results", staticmethod(broken))
+
+    with pytest.raises(ValueError):
+        transcribe.transcribe_gcs_large(GCS_URI, credentials=None, cache=None)
+    assert len(speech_calls) == 1
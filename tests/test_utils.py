@@ -0,0 +1,46 @@
+from utils import FormStreamParser, extract_form_with_confidence, normalize_confidence
+
+
+def test_normalize_confidence():
+    assert normalize_confidence([0.9, 1]) == [0.9, 1.0]
+    assert normalize_confidence(0.9) == [0.9]
+    assert normalize_confidence(["0.8", 0.5]) == [0.8, 0.5]
+    assert normalize_confidence(None) == [0.0]
+    assert normalize_confidence([]) == [0.0]
+    assert normalize_confidence("élevée") is None
+    assert normalize_confidence([0.9, None]) is None
+    assert normalize_confidence({"min": 0.2}) is None
+    assert normalize_confidence(True) is None
+
+
+def test_extract_form_normalizes_fields():
+    text = '''Voici le formulaire :
+{
+  "Nom": {"réponse": "Tremblay", "confiance": 0.9},
+  "Adresse": {"réponse": ["12", "rue", "Principale"], "confiance": ["0.8", 0.7, 0.6]},
+  "Emploi": {"réponse": "comptable", "confiance": "élevée"},
+  "Ville": {"réponse": "Montréal", "confiance": [0.95]}
+}'''
+    form = extract_form_with_confidence(text)
+    assert form == {
+        "Nom": {"réponse": "Tremblay", "confiance": [0.9]},
+        "Adresse": {"réponse": "12 rue Principale", "confiance": [0.8, 0.7, 0.6]},
+        "Ville": {"réponse": "Montréal", "confiance": [0.95]},
+    }
+
+
+def test_stream_parser_rejects_unreadable_confidence():
+    parser = FormStreamParser()
+    parser.feed('{"Nom": {"réponse": "Tremblay", "confiance": [0.9, "?"]}, ')
+    parser.feed('"Ville": {"réponse": "Laval", "confiance": [0.7]}}')
+    assert parser.fields == {"Ville": {"réponse": "Laval", "confiance": [0.7]}}
+    assert len(parser.errors) == 1 and parser.errors[0].startswith('"Nom"')
+
+
+def test_null_answer_is_missing():
+    parser = FormStreamParser()
+    parser.feed('{"Nom": {"réponse": null, "confiance": [0.9]}, ')
+    parser.feed('"Adresse": {"réponse": ["12", null, "rue"], "confiance": [0.8, 0.7]}}')
+    assert parser.fields == {"Adresse": {"réponse": "12 rue", "confiance": [0.8, 0.7]}}
+    assert len(parser.errors) == 1 and parser.errors[0].startswith('"Nom"')
+    assert "Nom" not in extract_form_with_confidence('{"Nom": {"réponse": null, "confiance": 0.9}}')
@@ -0,0 +1,193 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Journal des étapes, une ligne JSON par étape, partagé par l'app Streamlit et le serveur Flask
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join("logs", "traces.jsonl"))
+
+# Quantités cumulées par étape
+METRICS = ("bytes", "audio_seconds", "input_tokens", "output_tokens")
+
+_recording_sid = contextvars.ContextVar("recording_sid", default=None)
+_write_lock = threading.Lock()
+
+
+def set_recording(recording_sid):
+    # Les étapes suivantes de ce contexte sont rattachées à cet enregistrement
+    _recording_sid.set(recording_sid)
+
+
+def current_recording():
+    return _recording_sid.get()
+
+
+class Span:
+    def __init__(self, stage, recording_sid=None):
+        self.stage = stage
+        self.recording_sid = recording_sid
+        self.metrics = {}
+        self.attributes = {}
+
+    def add(self, **metrics):
+        # Cumuler : une étape peut déplacer ses octets en plusieurs fois
+        for name, value in metrics.items():
+            if value:
+                self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def tag(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(stage, recording_sid=None):
+    """Time a pipeline stage and append it to the trace log.
+
+    The yielded Span collects bytes moved, audio seconds and token counts
+    (``span.add(...)``) and free-form attributes (``span.tag(...)``).
+    """
+    current = Span(stage, recording_sid or _recording_sid.get())
+    timestamp = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except Exception as e:
+        status = "error"
+        current.tag(error=type(e).__name__)
+        raise
+    finally:
+        record = {
+            "recording_sid": current.recording_sid,
+            "stage": stage,
+            "timestamp": round(timestamp, 3),
+            "duration_seconds": round(time.perf_counter() - start, 6),
+            "status": status,
+            **current.metrics,
+            **current.attributes
+        }
+        write_span(record)
+
+
+def write_span(record, path=None):
+    path = path or TRACE_LOG_PATH
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Une seule écriture en mode ajout par ligne : pas de lignes entrelacées
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        # La trace ne doit jamais interrompre le traitement d'un appel
+        logger.warning(f"Could not write trace span: {e}")
+
+
+def read_spans(path=None):
+    path = path or TRACE_LOG_PATH
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # ligne en cours d'écriture
+    return records
+
+
+def load_trace(recording_sid, path=None):
+    return [record for record in read_spans(path) if record.get("recording_sid") == recording_sid]
+
+
+def summarize_trace(records):
+    # Une ligne par étape, dans l'ordre de première exécution
+    stages = {}
+    for record in records:
+        row = stages.setdefault(record["stage"], {"stage": record["stage"], "runs": 0, "errors": 0,
+                                                  "seconds": 0.0, **dict.fromkeys(METRICS, 0)})
+        row["runs"] += 1
+        row["errors"] += record.get("status") == "error"
+        row["seconds"] += record.get("duration_seconds", 0)
+        for name in METRICS:
+            row[name] += record.get(name, 0)
+    return list(stages.values())
+
+
+class TraceMetrics:
+    """Prometheus counters built from the trace log.
+
+    The log is read incrementally: each scrape only parses the lines written
+    since the previous one.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or TRACE_LOG_PATH
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.stages = {}
+
+    def refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self.offset:
+            self._reset()  # journal tronqué ou remplacé
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        # Ne consommer que les lignes complètes
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            try:
+                self._add(json.loads(line))
+            except (json.JSONDecodeError, KeyError):
+                continue
+        self.offset += complete
+
+    def _add(self, record):
+        totals = self.stages.setdefault(record["stage"], {"count": 0, "errors": 0, "seconds": 0.0,
+                                                          **dict.fromkeys(METRICS, 0)})
+        totals["count"] += 1
+        totals["errors"] += record.get("status") == "error"
+        totals["seconds"] += record.get("duration_seconds", 0)
+        for name in METRICS:
+            totals[name] += record.get(name, 0)
+
+    def render(self):
+        with self.lock:
+            self.refresh()
+            stages = sorted(self.stages.items())
+
+        lines = [
+            "# HELP ava_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE ava_stage_duration_seconds summary"
+        ]
+        for stage, totals in stages:
+            lines.append(f'ava_stage_duration_seconds_sum{{stage="{stage}"}} {totals["seconds"]:.6f}')
+            lines.append(f'ava_stage_duration_seconds_count{{stage="{stage}"}} {totals["count"]}')
+
+        counters = [
+            ("ava_stage_errors_total", "Pipeline stage runs that raised an error.", "errors"),
+            ("ava_stage_bytes_total", "Bytes downloaded, uploaded or produced by each stage.", "bytes"),
+            ("ava_stage_audio_seconds_total", "Seconds of call audio processed by each stage.", "audio_seconds"),
+        ]
+        for metric, help_text, name in counters:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{stage="{stage}"}} {totals[name]:g}' for stage, totals in stages]
+
+        lines += ["# HELP ava_llm_tokens_total LLM tokens used by each stage.", "# TYPE ava_llm_tokens_total counter"]
+        for stage, totals in stages:
+            if totals["input_tokens"] or totals["output_tokens"]:
+                lines.append(f'ava_llm_tokens_total{{stage="{stage}",type="input"}} {totals["input_tokens"]}')
+                lines.append(f'ava_llm_tokens_total{{stage="{stage}",type="output"}} {totals["output_tokens"]}')
+        return "\n".join(lines) + "\n"
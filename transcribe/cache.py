@@ -0,0 +1,62 @@
+from google.cloud import storage
+from transcribe.words import WordTable
+from disk_cache import DiskCache
+import hashlib
+import os
+import zipfile
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "transcripts")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256 Mo
+
+
+def config_fingerprint(config):
+    # Empreinte stable de la RecognitionConfig (clés triées, enums en entiers)
+    config_json = type(config).to_json(config, sort_keys=True, indent=None)
+    return hashlib.sha256(config_json.encode("utf-8")).hexdigest()
+
+
+def content_hash(data):
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def gcs_object_hash(gcs_uri, credentials):
+    # Identifier l'objet GCS par son contenu (md5) sans le télécharger
+    bucket_name, blob_name = gcs_uri[len("gs://"):].split("/", 1)
+    storage_client = storage.Client(credentials=credentials)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"GCS object not found: {gcs_uri}")
+    if blob.md5_hash:
+        return f"md5:{blob.md5_hash}"
+    # Les objets composites n'ont pas de md5 : la génération identifie la version
+    return f"generation:{gcs_uri}#{blob.generation}"
+
+
+def cache_key(source_hash, config):
+    return hashlib.sha256(f"{source_hash}|{config_fingerprint(config)}".encode("utf-8")).hexdigest()
+
+
+def gcs_cache_key(gcs_uri, credentials, config):
+    return cache_key(gcs_object_hash(gcs_uri, credentials), config)
+
+
+class TranscriptCache(DiskCache):
+    """Persistent transcript store, bounded in size with LRU eviction.
+
+    Each entry is a compressed WordTable (``.npz``) named after its key.
+    """
+
+    suffix = ".npz"
+    read_errors = (FileNotFoundError, zipfile.BadZipFile, KeyError)
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def load(self, path):
+        return WordTable.load(path)
+
+    def dump(self, transcript, f):
+        transcript.save(f)
+
+
+transcript_cache = TranscriptCache()
@@ -0,0 +1,79 @@
+from google.cloud import storage
+import io
+import os
+
+
+class AudioCodec:
+    def __init__(self, name, extension, content_type, encoding, export_parameters=None):
+        self.name = name
+        self.extension = extension
+        self.content_type = content_type
+        self.encoding = encoding  # nom de RecognitionConfig.AudioEncoding
+        self.export_parameters = export_parameters or {}
+
+    def __repr__(self):
+        return f"AudioCodec(name='{self.name}', encoding='{self.encoding}')"
+
+
+AUDIO_CODECS = {
+    "wav": AudioCodec("wav", "wav", "audio/wav", "LINEAR16"),
+    # Sans perte, 2 à 3 fois plus petit que le WAV pour de la voix téléphonique
+    "flac": AudioCodec("flac", "flac", "audio/flac", "FLAC"),
+    # Avec perte, pour les copies d'archive
+    "opus": AudioCodec("opus", "ogg", "audio/ogg", "OGG_OPUS",
+                       {"codec": "libopus", "bitrate": "16k", "parameters": ["-application", "voip"]}),
+}
+
+# Codec de transport vers GCS / Speech-to-Text, et codec optionnel des copies d'archive
+UPLOAD_CODEC = AUDIO_CODECS[os.getenv("AUDIO_UPLOAD_CODEC", "flac")]
+ARCHIVE_CODEC = AUDIO_CODECS.get(os.getenv("AUDIO_ARCHIVE_CODEC", ""))
+ARCHIVE_PREFIX = "archive/"
+
+
+class AudioDescriptor:
+    # Ce que la configuration de reconnaissance doit savoir de l'audio stocké
+    def __init__(self, encoding="LINEAR16", sample_rate_hertz=8000, channels=1):
+        self.encoding = encoding
+        self.sample_rate_hertz = sample_rate_hertz
+        self.channels = channels
+
+    def to_metadata(self):
+        return {
+            "encoding": self.encoding,
+            "sample_rate_hertz": str(self.sample_rate_hertz),
+            "channels": str(self.channels),
+        }
+
+    @classmethod
+    def from_blob(cls, blob):
+        metadata = blob.metadata or {}
+        if "encoding" in metadata:
+            return cls(metadata["encoding"], int(metadata.get("sample_rate_hertz", 8000)), int(metadata.get("channels", 1)))
+        # Objets sans métadonnées (téléversés avant) : déduire du nom de fichier
+        extension = blob.name.rsplit(".", 1)[-1].lower()
+        codec = next((codec for codec in AUDIO_CODECS.values() if codec.extension == extension), AUDIO_CODECS["wav"])
+        return cls(codec.encoding)
+
+
+def encode_audio(segment, codec=UPLOAD_CODEC):
+    # Encoder en mémoire, sans fichier temporaire
+    buffer = io.BytesIO()
+    segment.export(buffer, format=codec.extension, **codec.export_parameters)
+    return buffer.getvalue()
+
+
+def upload_audio(bucket, filename, segment, codec=UPLOAD_CODEC):
+    # Téléverser l'audio encodé avec son descripteur en métadonnées
+    blob = bucket.blob(filename)
+    blob.metadata = AudioDescriptor(codec.encoding, segment.frame_rate, segment.channels).to_metadata()
+    blob.upload_from_string(encode_audio(segment, codec), content_type=codec.content_type)
+    return blob
+
+
+def load_audio_descriptor(gcs_uri, credentials):
+    bucket_name, blob_name = gcs_uri[len("gs://"):].split("/", 1)
+    storage_client = storage.Client(credentials=credentials)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"GCS object not found: {gcs_uri}")
+    return AudioDescriptor.from_blob(blob)
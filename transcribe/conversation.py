@@ -0,0 +1,257 @@
+import numpy as np
+from transcribe.words import WordTable, as_word_table
+
+CUTOFF_THRESHOLD = 0.2  # 200 ms
+
+# Transcription compacte : seuls les mots sous ce seuil portent leur confiance, sur un chiffre
+LOW_CONFIDENCE = 0.7
+CONFIDENCE_MARK = "~"  # "mot~3" : confiance de 0.3 à 0.39
+# Confiance rendue pour un mot sans marque : le seuil, borne inférieure comme les chiffres
+# des mots marqués, pour que validate_form ne manque aucun champ signalé au format complet
+UNMARKED_CONFIDENCE = LOW_CONFIDENCE
+
+
+def default_speakers(channel_count):
+    # Appelant et destinataire, puis participants supplémentaires (conférences, transferts)
+    speakers = ['Caller', 'Receiver'] + [f'Speaker {i + 1}' for i in range(2, channel_count)]
+    return speakers[:channel_count]
+
+
+def split_turns(words: WordTable, cutoff_threshold: float = CUTOFF_THRESHOLD):
+    """Order the words of all channels into speaker turns.
+
+    Returns ``(order, bounds)``: ``order`` indexes the rows of ``words`` in
+    conversation order and ``bounds`` holds the start offset of each turn in
+    ``order`` (plus a final ``len(order)``).
+
+    A speaker keeps the floor until one of their pauses exceeds
+    ``cutoff_threshold`` and someone else speaks next. Words another speaker
+    says while the floor is held are moved to that speaker's next turn.
+    """
+    order, bounds, _ = _split_turns(words, cutoff_threshold)
+    return order, bounds
+
+
+def _split_turns(words: WordTable, cutoff_threshold: float):
+    # Comme split_turns, plus un masque (ordre de la conversation) des mots d'interjections
+    # qu'aucun tour ultérieur de leur locuteur n'a encore absorbées
+    n = len(words)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    # Tri global par début ; à égalité le canal le plus élevé passe en premier
+    order = np.lexsort((-words.channel.astype(np.int16), words.start))
+    start = words.start[order]
+    end = words.end[order]
+    channel = words.channel[order]
+    positions = np.arange(n)
+
+    # Mot suivant du même canal, pour mesurer la pause après chaque mot
+    by_channel = np.lexsort((positions, channel))
+    same_channel = channel[by_channel[1:]] == channel[by_channel[:-1]]
+    next_same = np.full(n, -1, dtype=np.int64)
+    next_same[by_channel[:-1][same_channel]] = by_channel[1:][same_channel]
+    has_next = next_same >= 0
+    released = np.ones(n, dtype=bool)
+    released[has_next] = start[next_same[has_next]] - end[has_next] > cutoff_threshold
+
+    # Segments : suites de mots d'un canal sans pause supérieure au seuil
+    segment_start = np.ones(n, dtype=bool)
+    segment_start[1:] = ~same_channel | released[by_channel[:-1]]
+    segment = np.empty(n, dtype=np.int64)
+    segment[by_channel] = np.cumsum(segment_start) - 1
+    segment_last = np.concatenate((segment_start[1:], [True]))
+    segment_end = by_channel[segment_last]  # position du dernier mot de chaque segment
+    segment_channel = channel[segment_end]
+    segment_count = len(segment_end)
+
+    # Après chaque segment, la parole passe au segment du mot suivant
+    next_segment = np.full(segment_count, -1, dtype=np.int64)
+    has_successor = segment_end + 1 < n
+    next_segment[has_successor] = segment[segment_end[has_successor] + 1]
+
+    # Chaîne des segments qui ont eu la parole (un pas par tour, pas par mot)
+    on_floor = np.zeros(segment_count, dtype=bool)
+    current = segment[0]
+    while current >= 0 and not on_floor[current]:
+        on_floor[current] = True
+        current = next_segment[current]
+
+    # Les interjections rejoignent le tour suivant du même locuteur,
+    # ou deviennent un tour à part s'il n'y en a plus
+    target = np.arange(segment_count)
+    for c in np.unique(segment_channel):
+        held = np.flatnonzero(on_floor & (segment_channel == c))
+        interjections = np.flatnonzero(~on_floor & (segment_channel == c))
+        if not len(interjections) or not len(held):
+            continue
+        index = np.searchsorted(segment_end[held], segment_end[interjections])
+        later = index < len(held)
+        target[interjections[later]] = held[index[later]]
+
+    # Ordre final : par tour (position de fin du segment porteur), puis par début
+    turn_key = segment_end[target][segment]
+    conversation_order = np.lexsort((positions, turn_key))
+    turn_channel = channel[conversation_order]
+
+    # Deux tours consécutifs du même locuteur n'en font qu'un
+    bounds = np.concatenate(([0], np.flatnonzero(turn_channel[1:] != turn_channel[:-1]) + 1, [n]))
+
+    # Interjections restées seules : un tour à venir de leur locuteur pourrait encore les absorber
+    unresolved = ~on_floor & (target == np.arange(segment_count))
+    return order[conversation_order], bounds, unresolved[segment][conversation_order]
+
+
+# Confiances affichées au centième : "0.00" à "1.00", indexées par confidence_hundredths
+CONFIDENCE_STRINGS = np.array([f"{i / 100:.2f}" for i in range(101)], dtype=object)
+
+
+def confidence_hundredths(confidence):
+    # Confiance arrondie au centième, en entier de 0 à 100 (confiances stockées en float32)
+    return np.clip(np.rint(np.asarray(confidence, dtype=np.float64) * 100), 0, 100).astype(np.int64)
+
+
+def mark_low_confidence(text, confidence):
+    # "mot~3" pour les mots sous LOW_CONFIDENCE, les autres inchangés ;
+    # le chiffre tronque la confiance arrondie au centième comme dans le format complet
+    hundredths = confidence_hundredths(confidence)
+    low = (hundredths < round(LOW_CONFIDENCE * 100)).tolist()
+    digits = np.minimum(hundredths // 10, 9).tolist()
+    return [f"{word}{CONFIDENCE_MARK}{digit}" if is_low else word
+            for word, is_low, digit in zip(text, low, digits)]
+
+
+def format_turns(words: WordTable, order, bounds, speakers, compact=False):
+    # Même format que rearrange_conversation : une ligne de mots, une ligne de confiances,
+    # ou une seule ligne de mots marqués en mode compact
+    text = words.words[order].tolist()
+    confidence = words.confidence[order]
+    turns = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    turn_speakers = [speakers[channel] for channel in words.channel[order[bounds[:-1]]].tolist()]
+    if compact:
+        marked = mark_low_confidence(text, confidence)
+        return [f"{speaker}: {' '.join(marked[a:b])}" for speaker, (a, b) in zip(turn_speakers, turns)]
+
+    scores = CONFIDENCE_STRINGS[confidence_hundredths(confidence)].tolist()
+    lines = []
+    for speaker, (a, b) in zip(turn_speakers, turns):
+        lines.append(f"{speaker}: {' '.join(text[a:b])}")
+        lines.append(f"Confidence: {' '.join(scores[a:b])}")
+    return lines
+
+
+def merge_conversation(transcripts, speakers=None, cutoff_threshold=CUTOFF_THRESHOLD, compact=False):
+    # Une transcription par canal (WordTable ou JSON), dans l'ordre des locuteurs
+    tables = [as_word_table(transcript, channel=i).with_channel(i) for i, transcript in enumerate(transcripts)]
+    words = WordTable.concat(tables)
+    speakers = speakers or default_speakers(len(tables))
+
+    order, bounds = split_turns(words, cutoff_threshold)
+    return '\n'.join(format_turns(words, order, bounds, speakers, compact=compact))
+
+
+def compact_conversation(conversation):
+    # Conversion d'une conversation au format complet (mots + ligne "Confidence:")
+    lines = conversation.split("\n")
+    compact = []
+    for i, line in enumerate(lines):
+        if line.startswith("Confidence: "):
+            continue
+        speaker, _, text = line.partition(": ")
+        following = lines[i + 1] if i + 1 < len(lines) else ""
+        words = text.split()
+        scores = following[len("Confidence: "):].split() if following.startswith("Confidence: ") else []
+        if len(scores) != len(words):
+            compact.append(line)
+            continue
+        compact.append(f"{speaker}: {' '.join(mark_low_confidence(words, [float(score) for score in scores]))}")
+    return "\n".join(compact)
+
+
+class ConversationBuilder:
+    """Builds the conversation incrementally as words arrive per channel.
+
+    Turns that later words can no longer change are formatted once and
+    appended to ``finalized_lines``; only the remaining words are merged
+    again on each update, so the cost follows the new words rather than the
+    length of the call.
+    """
+
+    def __init__(self, channel_count=2, speakers=None, cutoff_threshold=CUTOFF_THRESHOLD):
+        self.speakers = speakers or default_speakers(channel_count)
+        self.cutoff_threshold = cutoff_threshold
+        self.finalized_lines = []
+        self.pending = WordTable.empty()
+        # Instant jusqu'auquel chaque canal est connu : ses prochains mots commenceront après
+        self.watermarks = np.zeros(channel_count)
+
+    def add_words(self, channel, words, until=None):
+        table = as_word_table(words, channel=channel).with_channel(channel)
+        if len(table):
+            self.pending = WordTable.concat([self.pending, table])
+            until = max(until or 0, float(table.start.max()))
+        if until is not None:
+            self.watermarks[channel] = max(self.watermarks[channel], until)
+        self._finalize()
+        return self
+
+    def advance(self, channel, until):
+        # Un canal silencieux ne doit pas bloquer la finalisation des autres
+        return self.add_words(channel, WordTable.empty(), until=until)
+
+    def _finalize(self):
+        order, bounds, unresolved = _split_turns(self.pending, self.cutoff_threshold)
+        if len(bounds) < 3:
+            return
+
+        start = self.pending.start[order]
+        end = self.pending.end[order]
+        channel = self.pending.channel[order]
+
+        # Les mots d'un préfixe finalisé commencent tous avant ceux qui restent...
+        prefix_max = np.maximum.accumulate(start)
+        suffix_min = np.minimum.accumulate(start[::-1])[::-1]
+        candidates = bounds[1:-1]
+        safe = (prefix_max[candidates - 1] < suffix_min[candidates]) & \
+               (prefix_max[candidates - 1] < self.watermarks.min())
+
+        # ...et la pause après le dernier mot connu de chaque canal doit être acquise
+        for c in np.unique(channel):
+            last = np.flatnonzero(channel == c)[-1]
+            if end[last] + self.cutoff_threshold >= self.watermarks[c]:
+                safe &= candidates <= last
+
+        # Rien ne se finalise au-delà d'une interjection encore seule : elle peut
+        # rejoindre un tour à venir de son locuteur
+        if unresolved.any():
+            safe &= candidates <= np.argmax(unresolved)
+
+        # Le tour qui suit la coupure doit lui aussi être stable, sinon il pourrait
+        # encore rejoindre le tour suivant de son locuteur et fusionner les deux autres
+        stable = np.flatnonzero(safe[:-1] & safe[1:])
+        if not len(stable):
+            return
+        turn = stable[-1] + 1
+        cut = bounds[turn]
+        self.finalized_lines.extend(format_turns(self.pending, order[:cut], bounds[:turn + 1], self.speakers))
+        self.pending = self.pending.take(order[cut:])
+
+    def finish(self):
+        # Fin de l'appel : tous les tours restants deviennent définitifs
+        order, bounds = split_turns(self.pending, self.cutoff_threshold)
+        self.finalized_lines.extend(format_turns(self.pending, order, bounds, self.speakers))
+        self.pending = WordTable.empty()
+        return self.text
+
+    @property
+    def finalized_text(self):
+        return '\n'.join(self.finalized_lines)
+
+    @property
+    def tentative_lines(self):
+        order, bounds = split_turns(self.pending, self.cutoff_threshold)
+        return format_turns(self.pending, order, bounds, self.speakers)
+
+    @property
+    def text(self):
+        return '\n'.join(self.finalized_lines + self.tentative_lines)
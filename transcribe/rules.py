@@ -0,0 +1,148 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import operator
+import os
+import re
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "validation_rules.json")
+
+# Espaces, symboles monétaires et pourcentages ignorés dans les montants : "250 000 $" -> 250000
+NUMBER_NOISE = re.compile(r"[\s$%]")
+TYPE_PATTERNS = {
+    "email": re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+"),
+    "year": re.compile(r"(19|20)\d{2}"),
+}
+COMPARATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq}
+
+
+def parse_number(value: str) -> Optional[float]:
+    try:
+        return float(NUMBER_NOISE.sub("", value).replace(",", "."))
+    except ValueError:
+        return None
+
+
+class ValidationRule:
+    def __init__(self, applies_to: List[str], run: Callable[[str, Dict[str, str]], bool], msg: str,
+                 field_pattern: Optional[str] = None, required: bool = False):
+        self.applies_to = applies_to
+        self.run = run  # run(valeur, valeurs du formulaire) -> True si la règle est respectée
+        self.msg = msg
+        self.field_pattern = re.compile(field_pattern) if field_pattern else None
+        self.required = required  # sinon, une valeur vide n'est pas vérifiée
+
+    def __repr__(self):
+        return f"ValidationRule(applies_to={self.applies_to}, msg='{self.msg}')"
+
+
+def _regex_check(spec):
+    pattern = re.compile(spec["pattern"], re.IGNORECASE)
+    return lambda value, values: pattern.fullmatch(value.strip()) is not None
+
+
+def _length_check(spec):
+    ignored = str.maketrans("", "", spec.get("ignore", ""))
+    low, high = spec.get("min", 0), spec.get("max", float("inf"))
+    return lambda value, values: low <= len(value.translate(ignored)) <= high
+
+
+def _type_check(spec):
+    value_type = spec["value_type"]
+    if value_type == "number":
+        return lambda value, values: parse_number(value) is not None
+    if value_type == "integer":
+        return lambda value, values: parse_number(value) is not None and parse_number(value).is_integer()
+    pattern = TYPE_PATTERNS[value_type]
+    return lambda value, values: pattern.fullmatch(value.strip()) is not None
+
+
+def _range_check(spec):
+    low, high = spec.get("min", float("-inf")), spec.get("max", float("inf"))
+
+    def run(value, values):
+        # Les valeurs non numériques relèvent des règles de type
+        number = parse_number(value)
+        return number is None or low <= number <= high
+    return run
+
+
+def _compare_check(spec):
+    # Règle inter-champs : la valeur comparée à celle d'un autre champ du formulaire
+    other, compare = spec["other"], COMPARATORS[spec["op"]]
+
+    def run(value, values):
+        number, other_number = parse_number(value), parse_number(values.get(other, ""))
+        return number is None or other_number is None or compare(number, other_number)
+    return run
+
+
+RULE_TYPES = {
+    "regex": _regex_check,
+    "length": _length_check,
+    "type": _type_check,
+    "range": _range_check,
+    "compare": _compare_check,
+}
+
+
+def compile_rule(spec) -> ValidationRule:
+    if spec["type"] not in RULE_TYPES:
+        raise ValueError(f"Unknown validation rule type: {spec['type']}")
+    return ValidationRule(
+        applies_to=spec.get("fields", []),
+        run=RULE_TYPES[spec["type"]](spec),
+        msg=spec["msg"],
+        field_pattern=spec.get("field_pattern"),
+        required=spec.get("required", False)
+    )
+
+
+class RuleSet:
+    """Validation rules compiled once into a field -> rules index.
+
+    Rules name their fields explicitly or match them with ``field_pattern``;
+    pattern rules are resolved the first time a field is seen and the result
+    is kept in the index, so each field costs one dictionary lookup.
+    """
+
+    def __init__(self, rules: List[ValidationRule]):
+        self.rules = rules
+        self._index = {}
+        for rule in rules:
+            for field in rule.applies_to:
+                self._index.setdefault(field, []).append(rule)
+        self._pattern_rules = [rule for rule in rules if rule.field_pattern is not None]
+        self._resolved = set()
+        self._order = {id(rule): position for position, rule in enumerate(rules)}
+
+    def __len__(self):
+        return len(self.rules)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls([compile_rule(spec) for spec in config["rules"]])
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_config(json.load(f))
+
+    def rules_for(self, field: str) -> List[ValidationRule]:
+        if field not in self._resolved:
+            matched = [rule for rule in self._pattern_rules if rule.field_pattern.search(field)]
+            if matched:
+                explicit = self._index.get(field, [])
+                rules = explicit + [rule for rule in matched if rule not in explicit]
+                # Garder l'ordre du fichier de configuration
+                self._index[field] = sorted(rules, key=lambda rule: self._order[id(rule)])
+            self._resolved.add(field)
+        return self._index.get(field, [])
+
+    def check_field(self, field: str, value: str, values: Dict[str, str]) -> List[ValidationRule]:
+        # Règles non respectées par la valeur d'un champ
+        return [rule for rule in self.rules_for(field)
+                if (rule.required or value.strip()) and not rule.run(value, values)]
+
+    def check(self, values: Dict[str, str]) -> List[Tuple[str, ValidationRule]]:
+        # Tout le formulaire en un passage : (champ, règle non respectée)
+        return [(field, rule) for field, value in values.items() for rule in self.check_field(field, value, values)]
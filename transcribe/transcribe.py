@@ -1,8 +1,14 @@
 from google.cloud import speech
 from pydub import AudioSegment
-import os
+import io
 import json
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from transcribe.cache import transcript_cache, gcs_cache_key
+from transcribe.words import WordTable
+from transcribe.conversation import merge_conversation, CUTOFF_THRESHOLD
+from transcribe.vad import load_offset_map
+from transcribe.codec import load_audio_descriptor
+from tracing import span
 
 
 def split_stereo(input_path, output_path_left, output_path_right):
@@ -13,7 +19,55 @@ def split_stereo(input_path, output_path_left, output_path_right):
     left_channel.export(output_path_left, format="wav")
     right_channel.export(output_path_right, format="wav")
 
-def transcribe_local(path, credentials, crop_duration=None, channel=None):
+# Découpage de l'audio pour transcribe_local
+SEGMENT_DURATION_MS = 30 * 1000  # 30 secondes par segment
+SEGMENT_OVERLAP_MS = 1000  # chevauchement pour ne pas couper les mots aux frontières
+MAX_SEGMENT_SIZE = 10 * 1024 * 1024  # 10 Mo en octets
+MAX_CONCURRENT_SEGMENTS = 8  # nombre maximal de reconnaissances en vol
+
+
+def _encode_segment(segment):
+    # Encoder le segment en WAV en mémoire (pas de fichier temporaire partagé)
+    buffer = io.BytesIO()
+    segment.export(buffer, format="wav")
+    content = buffer.getvalue()
+    if len(content) > MAX_SEGMENT_SIZE:
+        raise ValueError("Le segment audio dépasse la limite de 10 Mo.")
+    return content
+
+
+def _transcribe_segment(client, audio, window_start, window_end):
+    # Le segment envoyé déborde de SEGMENT_OVERLAP_MS de chaque côté de sa fenêtre
+    clip_start = max(0, window_start - SEGMENT_OVERLAP_MS)
+    clip_end = min(len(audio), window_end + SEGMENT_OVERLAP_MS)
+    segment = audio[clip_start:clip_end]
+
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=segment.frame_rate,
+        language_code="fr-FR",
+        enable_word_time_offsets=True,
+    )
+    content = speech.RecognitionAudio(content=_encode_segment(segment))
+
+    # Les segments font moins d'une minute : la reconnaissance synchrone suffit
+    response = client.recognize(config=config, audio=content)
+
+    # Ne garder que les mots dont le milieu tombe dans la fenêtre du segment,
+    # les mots du chevauchement appartiennent au segment voisin
+    lines = []
+    for result in response.results:
+        words = []
+        for word in result.alternatives[0].words:
+            middle = clip_start + 500 * (word.start_time.total_seconds() + word.end_time.total_seconds())
+            if window_start <= middle < window_end:
+                words.append(word.word)
+        if words:
+            lines.append(" ".join(words))
+    return "\n".join(lines)
+
+
+def transcribe_local(path, credentials, crop_duration=None, channel=None, max_workers=MAX_CONCURRENT_SEGMENTS):
     # Load the audio file
     audio = AudioSegment.from_wav(path)
     
@@ -27,125 +81,120 @@ def transcribe_local(path, credentials, crop_duration=None, channel=None):
     
     # Ensure the audio is mono
     audio = audio.set_channels(1)
-    
-    # Diviser l'audio en segments de 30 secondes (ou moins)
-    segment_duration = 30 * 1000  # 30 secondes en millisecondes
-    max_segment_size = 10 * 1024 * 1024  # 10 Mo en octets
-    transcripts = []
-    
-    for i in range(0, len(audio), segment_duration):
-        segment = audio[i:i + segment_duration]
-        output_path = f"temp_segment_{i // segment_duration}.wav"
-        segment.export(output_path, format="wav")
-
-        # Lire le contenu du fichier WAV traité
-        with open(output_path, "rb") as audio_file:
-            content = audio_file.read()
-        
-        # Vérifier la taille du contenu
-        if len(content) > max_segment_size:  # Si le segment dépasse 10 Mo
-            raise ValueError("Le segment audio dépasse la limite de 10 Mo.")
-        
-        sample_rate = segment.frame_rate
-
-        # Instantiates a client
-        client = speech.SpeechClient(credentials=credentials)
-
-        # Configure the audio file
-        audio_content = speech.RecognitionAudio(content=content)  # Correction ici
 
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=sample_rate,
-            language_code="fr-FR",
-        )
-        
-        # Utiliser long_running_recognize pour chaque segment
-        operation = client.long_running_recognize(config=config, audio=audio_content)  # Correction ici
-        response = operation.result(timeout=600)
-
-        # Collect the transcript for the segment
-        segment_transcript = ""
-        for result in response.results:
-            segment_transcript += result.alternatives[0].transcript + "\n"
-        
-        transcripts.append(segment_transcript)
+    # Un seul client partagé par tous les segments
+    client = speech.SpeechClient(credentials=credentials)
+    windows = [(i, min(i + SEGMENT_DURATION_MS, len(audio))) for i in range(0, len(audio), SEGMENT_DURATION_MS)]
 
-        # Clean up the temporary file
-        os.remove(output_path)
+    # Les segments sont transcrits en parallèle, au plus max_workers à la fois,
+    # puis réassemblés dans l'ordre
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        transcripts = list(executor.map(lambda window: _transcribe_segment(client, audio, *window), windows))
 
     # Combine all transcripts
     return "\n".join(transcripts)
 
 
-def transcribe_gcs_large(gcs_uri, credentials):
-    # Instantiates a client
-    client = speech.SpeechClient(credentials=credentials)
-
-    # Configure the audio file from GCS URI
-    audio = speech.RecognitionAudio(uri=gcs_uri)
-
+def build_recognition_config(audio_channel_count=1, encoding="LINEAR16", sample_rate_hertz=8000):
     config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        sample_rate_hertz=8000,
+        encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+        sample_rate_hertz=sample_rate_hertz,
         language_code="fr-CA",
         use_enhanced=True,
         model="telephony",
         enable_automatic_punctuation=True,
         enable_word_time_offsets=True,
         enable_word_confidence=True,
-        audio_channel_count=1,
+        audio_channel_count=audio_channel_count,
+        # Avec plusieurs canaux, chaque canal est reconnu séparément (channel_tag)
+        enable_separate_recognition_per_channel=audio_channel_count > 1,
         profanity_filter=False,
         speech_contexts=[speech.SpeechContext(
             phrases=["adresse ", "rue", "date de naissance","travail","dettes", "rayan", "bechichi", "assurance"],
             boost=20
         )]
     )
+    return config
+
+
+def recognition_config_for(gcs_uri, credentials, audio_channel_count=1):
+    # L'encodage et la fréquence viennent du descripteur stocké avec l'objet
+    descriptor = load_audio_descriptor(gcs_uri, credentials)
+    return build_recognition_config(audio_channel_count, descriptor.encoding, descriptor.sample_rate_hertz)
+
+
+def response_to_dict(results):
+    return {
+        "results": [
+            {
+                "alternatives": [
+                    {
+                        "transcript": alt.transcript,
+                        "confidence": alt.confidence,
+                        "words": [
+                            {
+                                "word": word.word,
+                                "start_time": word.start_time.total_seconds(),
+                                "end_time": word.end_time.total_seconds(),
+                                "confidence": word.confidence
+                            } for word in alt.words
+                        ]
+                    } for alt in result.alternatives
+                ]
+            } for result in results
+        ]
+    }
+
+
+def _billed_seconds(response):
+    # Durée d'audio facturée par Speech-to-Text (timedelta), 0 si absente
+    billed = getattr(response, "total_billed_time", None)
+    return billed.total_seconds() if billed else 0
+
+
+def transcribe_gcs_large(gcs_uri, credentials, cache=transcript_cache, channel=0, return_cached=False):
+    # return_cached : renvoie (words, cached), cached vrai si la transcription vient du cache
+    with span("transcribe") as trace:
+        words, cached = _transcribe_gcs_large(gcs_uri, credentials, cache, channel, trace)
+    return (words, cached) if return_cached else words
+
+
+def _transcribe_gcs_large(gcs_uri, credentials, cache, channel, trace):
+    config = recognition_config_for(gcs_uri, credentials)
+
+    # Un objet déjà transcrit avec la même configuration est servi depuis le cache
+    key = gcs_cache_key(gcs_uri, credentials, config) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Transcript for {gcs_uri} loaded from cache")
+            trace.tag(cached=True)
+            return cached.with_channel(channel), True
+
+    # Audio réduit par la détection de parole : table de retour au temps de l'appel.
+    # Lue avant la reconnaissance pour qu'une erreur de métadonnées remonte aussitôt
+    offset_map = load_offset_map(gcs_uri, credentials)
+
+    # Instantiates a client
+    client = speech.SpeechClient(credentials=credentials)
+
+    # Configure the audio file from GCS URI
+    audio = speech.RecognitionAudio(uri=gcs_uri)
         
     # Asynchronously detect speech in the audio file
     operation = client.long_running_recognize(config=config, audio=audio)
 
-    print(f"Waiting for operation to complete...")
+    print("Waiting for operation to complete...")
     response = operation.result(timeout=900)
+    trace.add(audio_seconds=_billed_seconds(response))
 
-    # Write raw response to file and print to console
+    # Convert the raw response to a word table and store it in the transcript cache
     try:
-        raw_response_dict = {
-            "results": [
-                {
-                    "alternatives": [
-                        {
-                            "transcript": alt.transcript,
-                            "confidence": alt.confidence,
-                            "words": [
-                                {
-                                    "word": word.word,
-                                    "start_time": word.start_time.total_seconds(),
-                                    "end_time": word.end_time.total_seconds(),
-                                    "confidence": word.confidence
-                                } for word in alt.words
-                            ]
-                        } for alt in result.alternatives
-                    ]
-                } for result in response.results
-            ]
-        }
-        
-        # Create logs directory if it doesn't exist
-        os.makedirs("logs", exist_ok=True)
-        
-        # Generate filename with current date and time
-        current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"logs/logs_{current_datetime}.json"
-        
-        # Write raw response to file
-        with open(log_filename, "w", encoding="utf-8") as f:
-            json.dump(raw_response_dict, f, indent=2, ensure_ascii=False)
-        
-        print(f"Raw Speech-to-Text Response written to: {log_filename}")
+        words = WordTable.from_results(response.results, channel=channel)
     except Exception as e:
+        # Afficher la réponse brute pour le diagnostic, puis laisser l'erreur remonter
         print(f"Error while processing raw response: {str(e)}")
-        print("Falling back to basic response structure:")
+        print("Basic response structure:")
         basic_response = {
             "results": [
                 {
@@ -159,69 +208,57 @@ def transcribe_gcs_large(gcs_uri, credentials):
             ]
         }
         print(json.dumps(basic_response, indent=2))
+        raise
 
+    if offset_map is not None:
+        words = offset_map.apply(words)
+    if key is not None:
+        cache.put(key, words)
+    return words, False
 
-    return raw_response_dict
-
-def rearrange_conversation(raw_caller_transcript, raw_receiver_transcript):
-    def parse_transcript(transcript):
-        parsed = []
-        for result in transcript['results']:
-            for alternative in result['alternatives']:
-                for word_info in alternative['words']:
-                    parsed.append({
-                        'word': word_info['word'],
-                        'start_time': word_info['start_time'],
-                        'end_time': word_info['end_time'],
-                        'confidence': word_info['confidence']
-                    })
-        return parsed
-
-    def add_utterance(speaker, utterance, conversation):
-        if utterance:
-            words = ' '.join(word['word'] for word in utterance)
-            confidence = ' '.join(f"{word['confidence']:.2f}" for word in utterance)
-            conversation.append(f"{speaker}: {words}")
-            conversation.append(f"Confidence: {confidence}")
-
-    caller_transcript = parse_transcript(raw_caller_transcript)
-    receiver_transcript = parse_transcript(raw_receiver_transcript)
-
-    conversation = []
-    caller_ptr, receiver_ptr = 0, 0
-    current_speaker = 'Caller'
-    utterances = {'Caller': [], 'Receiver': []}
-    cutoff_threshold = 0.2  # 200 ms
-
-    while caller_ptr < len(caller_transcript) and receiver_ptr < len(receiver_transcript):
-        caller_word = caller_transcript[caller_ptr]
-        receiver_word = receiver_transcript[receiver_ptr]
-        
-        if caller_word['start_time'] < receiver_word['start_time']:
-            next_speaker = 'Caller'
-            utterances[next_speaker].append(caller_word)
-            caller_ptr += 1
-        else:
-            next_speaker = 'Receiver'
-            utterances[next_speaker].append(receiver_word)
-            receiver_ptr += 1
-
-        if current_speaker != next_speaker:
-            current_transcript = caller_transcript if current_speaker == 'Caller' else receiver_transcript
-            current_ptr = caller_ptr if current_speaker == 'Caller' else receiver_ptr
-
-            if current_ptr < len(current_transcript) and \
-               current_transcript[current_ptr]['start_time'] - current_transcript[current_ptr-1]['end_time'] > cutoff_threshold:
-                add_utterance(current_speaker, utterances[current_speaker], conversation)
-                utterances[current_speaker] = []
-                current_speaker = next_speaker
-
-    # Add any remaining words from the longer transcript
-    remaining_speaker = 'Caller' if caller_ptr < len(caller_transcript) else 'Receiver'
-    remaining_transcript = caller_transcript if remaining_speaker == 'Caller' else receiver_transcript
-    remaining_ptr = caller_ptr if remaining_speaker == 'Caller' else receiver_ptr
-
-    utterances[remaining_speaker].extend(remaining_transcript[remaining_ptr:])
-    add_utterance(remaining_speaker, utterances[remaining_speaker], conversation)
-
-    return '\n'.join(conversation)
+
+def transcribe_gcs_stereo(gcs_uri, credentials, audio_channel_count=2, cache=transcript_cache):
+    with span("transcribe") as trace:
+        return _transcribe_gcs_stereo(gcs_uri, credentials, audio_channel_count, cache, trace)
+
+
+def _transcribe_gcs_stereo(gcs_uri, credentials, audio_channel_count, cache, trace):
+    # Une seule reconnaissance pour l'enregistrement stéréo complet :
+    # canal 1 = appelant, canal 2 = destinataire
+    config = recognition_config_for(gcs_uri, credentials, audio_channel_count=audio_channel_count)
+
+    key = gcs_cache_key(gcs_uri, credentials, config) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Transcript for {gcs_uri} loaded from cache")
+            trace.tag(cached=True)
+            return [cached.for_channel(i) for i in range(audio_channel_count)]
+
+    client = speech.SpeechClient(credentials=credentials)
+    audio = speech.RecognitionAudio(uri=gcs_uri)
+
+    operation = client.long_running_recognize(config=config, audio=audio)
+
+    print("Waiting for operation to complete...")
+    response = operation.result(timeout=900)
+    trace.add(audio_seconds=_billed_seconds(response))
+
+    # Répartir les résultats par channel_tag (1..audio_channel_count)
+    results_by_channel = [[] for _ in range(audio_channel_count)]
+    for result in response.results:
+        results_by_channel[max(result.channel_tag, 1) - 1].append(result)
+
+    # Une WordTable par canal, dans l'ordre (caller, receiver)
+    tables = [WordTable.from_results(results, channel=i) for i, results in enumerate(results_by_channel)]
+    offset_map = load_offset_map(gcs_uri, credentials)
+    if offset_map is not None:
+        tables = [offset_map.apply(table) for table in tables]
+    if key is not None:
+        cache.put(key, WordTable.concat(tables))
+    return tables
+
+def rearrange_conversation(*transcripts, speakers=None, cutoff_threshold=CUTOFF_THRESHOLD, compact=False):
+    # Une transcription par canal : (caller, receiver), ou davantage pour une conférence
+    # compact : une ligne par tour, seuls les mots peu sûrs portent leur confiance ("mot~3")
+    return merge_conversation(transcripts, speakers=speakers, cutoff_threshold=cutoff_threshold, compact=compact)
@@ -0,0 +1,122 @@
+from google.cloud import storage
+from pydub import AudioSegment
+from transcribe.words import WordTable
+import numpy as np
+import json
+
+FRAME_MS = 20  # taille des trames d'analyse
+THRESHOLD_DB = 12  # parole : énergie au moins 12 dB au-dessus du bruit de fond
+MIN_SPEECH_DBFS = -50  # sous ce niveau, une trame n'est jamais de la parole
+KEEP_SILENCE_MS = 250  # silence conservé autour de la parole (début et fin de mots)
+MIN_SPEECH_MS = 100  # rafales d'énergie plus courtes ignorées (clics, bips)
+
+
+class OffsetMap:
+    """Maps times in trimmed audio back to the original call time.
+
+    Region ``i`` starts at ``trimmed_starts[i]`` in the trimmed audio and at
+    ``original_starts[i]`` in the original recording (both in seconds).
+    """
+
+    def __init__(self, trimmed_starts, original_starts):
+        self.trimmed_starts = np.asarray(trimmed_starts, dtype=np.float64)
+        self.original_starts = np.asarray(original_starts, dtype=np.float64)
+
+    def to_original(self, times):
+        times = np.asarray(times, dtype=np.float64)
+        if not len(self.trimmed_starts):
+            return times
+        region = np.clip(np.searchsorted(self.trimmed_starts, times, side='right') - 1, 0, None)
+        return self.original_starts[region] + (times - self.trimmed_starts[region])
+
+    def apply(self, words: WordTable) -> WordTable:
+        # Ramener les temps des mots reconnus sur l'audio réduit au temps de l'appel
+        return WordTable(words.vocab, words.word_ids, self.to_original(words.start), self.to_original(words.end),
+                         words.confidence, words.channel, words.result_ids)
+
+    def to_json(self):
+        # Millisecondes entières : compact et exact à la trame près
+        return json.dumps({
+            "trimmed_ms": np.round(self.trimmed_starts * 1000).astype(int).tolist(),
+            "original_ms": np.round(self.original_starts * 1000).astype(int).tolist()
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(np.array(data["trimmed_ms"]) / 1000, np.array(data["original_ms"]) / 1000)
+
+
+def _frame_samples(audio: AudioSegment):
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels)
+    frame_length = audio.frame_rate * FRAME_MS // 1000
+    frame_count = len(samples) // frame_length
+    return samples, frame_length, frame_count
+
+
+def speech_frames(audio: AudioSegment):
+    # Masque des trames de parole, tous canaux confondus
+    if audio.sample_width != 2:
+        audio = audio.set_sample_width(2)
+    samples, frame_length, frame_count = _frame_samples(audio)
+    if frame_count == 0:
+        return np.zeros(0, dtype=bool)
+
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length, -1).astype(np.float64)
+    energy = np.mean(frames ** 2, axis=1) + 1e-9
+    level_db = 10 * np.log10(energy / (32768.0 ** 2))  # dBFS par trame et par canal
+
+    # Seuil adaptatif au bruit de fond de chaque canal
+    noise_floor = np.percentile(level_db, 10, axis=0)
+    threshold = np.maximum(noise_floor + THRESHOLD_DB, MIN_SPEECH_DBFS)
+    speech = (level_db > threshold).any(axis=1)
+
+    # Ignorer les rafales trop courtes, puis garder une marge autour de la parole
+    min_frames = max(1, MIN_SPEECH_MS // FRAME_MS)
+    run_id = np.cumsum(np.concatenate(([True], speech[1:] != speech[:-1])))
+    run_length = np.bincount(run_id)[run_id]
+    speech &= run_length >= min_frames
+
+    pad = KEEP_SILENCE_MS // FRAME_MS
+    if pad:
+        speech = np.convolve(speech, np.ones(2 * pad + 1), mode='same') > 0
+    return speech
+
+
+def trim_silence(audio: AudioSegment):
+    """Remove non-speech regions; returns the trimmed audio and its OffsetMap."""
+    if audio.sample_width != 2:
+        audio = audio.set_sample_width(2)
+    keep = speech_frames(audio)
+    samples, frame_length, frame_count = _frame_samples(audio)
+    if not keep.any():
+        return audio, OffsetMap([0.0], [0.0])
+
+    # Le reste incomplet en fin de fichier suit la dernière trame
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length, -1)
+    kept = frames[keep].reshape(-1, audio.channels)
+    if keep[-1]:
+        kept = np.concatenate((kept, samples[frame_count * frame_length:]))
+
+    # Début de chaque région conservée, dans l'audio réduit et dans l'original
+    region_start = np.flatnonzero(keep & ~np.concatenate(([False], keep[:-1])))
+    kept_before = np.cumsum(keep) - keep
+    frame_seconds = FRAME_MS / 1000
+    offset_map = OffsetMap(kept_before[region_start] * frame_seconds, region_start * frame_seconds)
+
+    trimmed = audio._spawn(np.ascontiguousarray(kept).tobytes())
+    return trimmed, offset_map
+
+
+def offsets_blob_name(blob_name):
+    return f"{blob_name}.offsets.json"
+
+
+def load_offset_map(gcs_uri, credentials):
+    # Table de correspondance téléversée à côté de l'audio réduit, ou None
+    bucket_name, blob_name = gcs_uri[len("gs://"):].split("/", 1)
+    storage_client = storage.Client(credentials=credentials)
+    blob = storage_client.bucket(bucket_name).get_blob(offsets_blob_name(blob_name))
+    if blob is None:
+        return None
+    return OffsetMap.from_json(blob.download_as_text())
@@ -1,103 +1,117 @@
-import json
-import re
-from typing import List, Callable, Tuple, Dict, Any
-import io
-from pydub import AudioSegment
-from difflib import SequenceMatcher
-
-class ValidationRule:
-    def __init__(self, applies_to: List[str], run: Callable[[str], bool], msg: str):
-        self.applies_to = applies_to
-        self.run = run
-        self.msg = msg
-
-    def __repr__(self):
-        return f"ValidationRule(applies_to={self.applies_to}, msg='{self.msg}')"
-
-validation_rules = [
-    ValidationRule(
-        applies_to=["Telephone_client_1", "Cell_2"],
-        run=lambda x: len(x.replace(" ", "")) >= 10,
-        msg="must be at least 10 characters long"
-    ),
-    ValidationRule(
-        applies_to=["Client 2-Courriel (personnel)"],
-        run=lambda x: '@' in x,
-        msg="must be an email address"
-    )
-]
+from typing import List, Tuple, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from transcribe.words import WordTable, as_word_table
+from transcribe.word_index import WordIndex, PhraseMatch
+from transcribe.clips import CLIP_FORMAT, as_pcm_channel, render_clips
+from transcribe.rules import RuleSet
+from tracing import span
+
+# Règles chargées de transcribe/validation_rules.json et indexées par champ une seule fois
+validation_rules = RuleSet.load()
+
+# Index des mots d'un appel, construit une fois et réutilisé d'une validation à l'autre
+INDEX_CACHE_SIZE = 8
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def word_index_for(logs: List[Any]) -> WordIndex:
+    key = tuple(id(log) for log in logs)
+    with _index_cache_lock:
+        entry = _index_cache.get(key)
+        # Garder les transcriptions en référence : leurs id() ne peuvent pas être réutilisés
+        if entry is not None and all(a is b for a, b in zip(entry[0], logs)):
+            _index_cache.move_to_end(key)
+            return entry[1]
+
+    # Une WordTable (ou transcription JSON) par canal
+    words = WordTable.concat([as_word_table(log, channel=i) for i, log in enumerate(logs)])
+    index = WordIndex(words)
+    with _index_cache_lock:
+        _index_cache[key] = (tuple(logs), index)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
 
 class AudioFinder:
-    def __init__(self, logs: List[Dict[str, Any]], audios: List[AudioSegment]):
-        self.logs = logs
+    CLIP_PADDING = 2.0  # secondes d'audio gardées avant et après les mots trouvés
+
+    def __init__(self, logs: List[Any], audios: List[Any], clip_format=CLIP_FORMAT):
+        self.index = word_index_for(logs)
+        self.clip_format = clip_format
         
         # Ensure we have exactly two audio channels
         if len(audios) != 2:
             raise ValueError("Exactly two audio channels are required")
         
-        # Combine the two audio channels
-        self.combined_audio = AudioSegment.from_mono_audiosegments(audios[0], audios[1])
+        # Canaux lus sans copie (vue sur l'AudioSegment ou WAV projeté en mémoire) :
+        # seuls les extraits demandés sont entrelacés
+        self.channels = [as_pcm_channel(audio) for audio in audios]
+        self.duration_ms = max(len(channel) for channel in self.channels)
+        self._clips = {}
+
+    def find(self, value: str) -> Optional[PhraseMatch]:
+        # Mots de la transcription correspondant à la valeur (exacte, sinon approchée)
+        return self.index.find(value)
+
+    def window(self, match: PhraseMatch) -> Optional[Tuple[int, int]]:
+        # Fenêtre (ms) centrée sur les mots trouvés, bornée à la durée de l'appel
+        start_ms = max(int((match.start - self.CLIP_PADDING) * 1000), 0)
+        end_ms = min(int((match.end + self.CLIP_PADDING) * 1000), self.duration_ms)
+        return (start_ms, end_ms) if end_ms > start_ms else None
+
+    def clips(self, windows) -> Dict[Tuple[int, int], bytes]:
+        # Extraits encodés dans clip_format, rendus en un lot et mis en cache par fenêtre
+        missing = {window for window in windows if window not in self._clips}
+        if missing:
+            self._clips.update(render_clips(self.channels, missing, self.clip_format))
+        return {window: self._clips[window] for window in windows}
 
     def get_audio_segment(self, value: str) -> bytes:
-        best_match = None
-        best_ratio = 0
-        best_audio = None
-
-        for log in self.logs:
-            for result in log['results']:
-                transcript = result['alternatives'][0]['transcript'].lower()
-                value_lower = value.lower()
-
-                # Check for exact match first
-                if value_lower in transcript:
-                    start_time = float(result['alternatives'][0]['words'][0]['start_time'])
-                    start_ms = int(start_time * 1000)
-                    end_ms = min(start_ms + 15000, len(self.combined_audio))
-                    
-                    audio_segment = self.combined_audio[start_ms:end_ms]
-                    if audio_segment:
-                        buffer = io.BytesIO()
-                        audio_segment.export(buffer, format="wav")
-                        return buffer.getvalue()
-
-                # If no exact match, find the best partial match
-                ratio = SequenceMatcher(None, value_lower, transcript).ratio()
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match = result
-                    best_audio = self.combined_audio
-
-        # If we found a partial match
-        if best_match and best_ratio > 0.5:
-            start_time = float(best_match['alternatives'][0]['words'][0]['start_time'])
-            start_ms = int((start_time-5) * 1000)
-            end_ms = min(start_ms + 15000, len(best_audio))
-            
-            audio_segment = best_audio[start_ms:end_ms]
-            if audio_segment:
-                buffer = io.BytesIO()
-                audio_segment.export(buffer, format="wav")
-                return buffer.getvalue()
-
-        return b''  # return empty bytes if no audio is found
-
-def validate_form(form: Dict[str, any], logs: List[Dict[str, Any]], audios: List[AudioSegment]) -> Tuple[List[Tuple[str, bytes]], Dict[str, str]]:
-    audio_finder = AudioFinder(logs, audios)
-    issues = []
-    
+        match = self.find(value)
+        window = self.window(match) if match is not None else None
+        if window is None:
+            return b''  # return empty bytes if no audio is found
+        return self.clips([window])[window]
+
+def validate_form(form: Dict[str, any], logs: List[Any], audios: List[Any], clip_store=None,
+                  clip_format=CLIP_FORMAT) -> List[Tuple[str, Any]]:
+    # Issues are (message, clip bytes), or (message, clip id) when a ClipStore is given
+    with span("validate_form") as trace:
+        issues = _validate_form(form, logs, audios, clip_format)
+        trace.add(bytes=sum(len(audio or b'') for _, audio in issues))
+        trace.tag(issues=len(issues), clip_format=clip_format.name)
+        if clip_store is not None:
+            issues = [(message, clip_store.put(audio, clip_format.mime_type) if audio else None)
+                      for message, audio in issues]
+        return issues
 
+def _validate_form(form, logs, audios, clip_format=CLIP_FORMAT):
+    audio_finder = AudioFinder(logs, audios, clip_format)
+
+    # Phase 1 : relever les problèmes, avec la valeur dont il faut l'extrait
+    pending = []
+    values = {key: value['réponse'] for key, value in form.items()}
     for key, value in form.items():
-        confidence = value['confiance']
+        confidence = value.get('confiance')
+        # Confiance absente ou illisible : inconnue, donc signalée
+        if not isinstance(confidence, list) or not confidence or \
+                not all(isinstance(score, (int, float)) for score in confidence):
+            confidence = [0.0]
 
         # Check for uncertainties
         if (sum(confidence) / len(confidence) < 0.5 or min(confidence) < 0.1) and not value['réponse'].replace(" ", "").isnumeric():
-            audio = audio_finder.get_audio_segment(value['réponse'])
-            issues.append((f"Low confidence for {key}: {value['réponse']}", audio))
+            pending.append((f"Low confidence for {key}: {value['réponse']}", value['réponse']))
 
         # Check for broken rules
-        for rule in validation_rules:
-            if key in rule.applies_to and not rule.run(value['réponse']):
-                audio = audio_finder.get_audio_segment(value['réponse'])
-                issues.append((f"{key} {rule.msg}: {value['réponse']}", audio))
+        for rule in validation_rules.check_field(key, value['réponse'], values):
+            pending.append((f"{key} {rule.msg}: {value['réponse']}", value['réponse']))
+
+    # Phase 2 : une recherche par valeur distincte, puis tous les extraits en un lot
+    windows = {}
+    for value in dict.fromkeys(value for _, value in pending):
+        match = audio_finder.find(value)
+        windows[value] = audio_finder.window(match) if match is not None else None
+    clips = audio_finder.clips({window for window in windows.values() if window is not None})
 
-    return issues
\ No newline at end of file
+    return [(message, clips.get(windows[value], b'')) for message, value in pending]
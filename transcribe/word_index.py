@@ -0,0 +1,141 @@
+from difflib import SequenceMatcher
+from typing import List, NamedTuple, Optional
+from transcribe.words import WordTable
+import numpy as np
+import re
+import unicodedata
+
+FUZZY_THRESHOLD = 0.7  # similarité minimale entre la valeur et les mots retenus
+TOKEN_THRESHOLD = 0.6  # similarité minimale entre un mot de la valeur et un mot du vocabulaire
+MAX_SIMILAR_TOKENS = 5  # mots du vocabulaire retenus par mot de la valeur
+MAX_ANCHORS = 2  # mots les plus rares de la valeur servant à placer les fenêtres candidates
+
+
+def normalize(text):
+    # Minuscules, sans accents ni ponctuation : "Saint-Jérôme," -> ["saint", "jerome"]
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def _trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PhraseMatch(NamedTuple):
+    channel: int
+    start: float  # début du premier mot, en secondes
+    end: float  # fin du dernier mot, en secondes
+    score: float  # 1.0 pour une correspondance exacte
+
+
+class WordIndex:
+    """Positional index of the normalized words of a call.
+
+    Words are ordered by channel then time and split into normalized tokens.
+    Each token maps to the sorted positions where it occurs, so a phrase is
+    found by checking only the occurrences of its rarest token; fuzzy lookup
+    first maps each phrase token to similar vocabulary tokens through a
+    character-trigram index.
+    """
+
+    def __init__(self, words: WordTable):
+        order = np.lexsort((words.start, words.channel))
+        word_ids = words.word_ids[order]
+
+        # Mots du vocabulaire découpés en jetons normalisés
+        self.tokens = {}
+        vocab_tokens = [[self.tokens.setdefault(token, len(self.tokens)) for token in normalize(word)]
+                        for word in words.vocab]
+        lengths = np.array([len(tokens) for tokens in vocab_tokens], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        flat = np.array([token for tokens in vocab_tokens for token in tokens], dtype=np.int32)
+
+        # Un jeton par position : un mot comme "555-1234" en donne deux
+        token_lengths = lengths[word_ids] if len(word_ids) else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(word_ids)), token_lengths)
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(token_lengths) - token_lengths, token_lengths)
+        self.token_ids = flat[offsets[word_ids[rows]] + within] if len(rows) else np.zeros(0, dtype=np.int32)
+        self.channel = words.channel[order][rows]
+        self.start = words.start[order][rows]
+        self.end = words.end[order][rows]
+
+        # Listes de positions par jeton, triées
+        self._positions = np.argsort(self.token_ids, kind="stable")
+        self._bounds = np.concatenate(([0], np.cumsum(np.bincount(self.token_ids, minlength=len(self.tokens)))))
+
+        self._vocab = list(self.tokens)
+        self._trigram_index = {}
+        for token_id, token in enumerate(self._vocab):
+            for trigram in _trigrams(token):
+                self._trigram_index.setdefault(trigram, []).append(token_id)
+
+    def __len__(self):
+        return len(self.token_ids)
+
+    def positions(self, token_id):
+        return self._positions[self._bounds[token_id]:self._bounds[token_id + 1]]
+
+    def _match(self, position, length, score):
+        last = position + length - 1
+        return PhraseMatch(int(self.channel[position]), float(self.start[position]), float(self.end[last]), score)
+
+    def _windows(self, starts, length):
+        # Fenêtres valides : dans l'index et sur un seul canal
+        starts = starts[(starts >= 0) & (starts + length <= len(self))]
+        return starts[self.channel[starts] == self.channel[starts + length - 1]]
+
+    def exact(self, phrase) -> List[PhraseMatch]:
+        query = [self.tokens.get(token) for token in normalize(phrase)]
+        if not query or None in query:
+            return []
+        counts = [self._bounds[token + 1] - self._bounds[token] for token in query]
+        anchor = int(np.argmin(counts))
+        starts = self._windows(self.positions(query[anchor]) - anchor, len(query))
+        found = (self.token_ids[starts[:, None] + np.arange(len(query))] == query).all(axis=1)
+        return [self._match(int(start), len(query), 1.0) for start in starts[found]]
+
+    def similar_tokens(self, token):
+        # Mots du vocabulaire partageant des trigrammes, classés par similarité
+        candidates = {token_id for trigram in _trigrams(token) for token_id in self._trigram_index.get(trigram, ())}
+        scored = [(SequenceMatcher(None, token, self._vocab[token_id]).ratio(), token_id) for token_id in candidates]
+        scored = sorted((item for item in scored if item[0] >= TOKEN_THRESHOLD), reverse=True)
+        return [token_id for _, token_id in scored[:MAX_SIMILAR_TOKENS]]
+
+    def fuzzy(self, phrase) -> Optional[PhraseMatch]:
+        query = normalize(phrase)
+        if not query:
+            return None
+        query_text = " ".join(query)
+
+        # Placer les fenêtres à partir des mots les plus rares de la valeur
+        anchors = []
+        for offset, token in enumerate(query):
+            similar = self.similar_tokens(token)
+            if similar:
+                occurrences = sum(self._bounds[token_id + 1] - self._bounds[token_id] for token_id in similar)
+                anchors.append((occurrences, offset, similar))
+        if not anchors:
+            return None
+        starts = np.unique(np.concatenate([
+            self.positions(token_id) - offset
+            for _, offset, similar in sorted(anchors)[:MAX_ANCHORS]
+            for token_id in similar
+        ]))
+        starts = self._windows(starts, len(query))
+
+        best, best_score = None, FUZZY_THRESHOLD
+        for start in starts.tolist():
+            window = " ".join(self._vocab[token_id] for token_id in self.token_ids[start:start + len(query)])
+            score = SequenceMatcher(None, query_text, window).ratio()
+            if score > best_score or (score == best_score and best is not None and self.start[start] < best.start):
+                best, best_score = self._match(start, len(query), score), score
+        return best
+
+    def find(self, phrase) -> Optional[PhraseMatch]:
+        # Première occurrence exacte, sinon la meilleure correspondance approchée
+        matches = self.exact(phrase)
+        if matches:
+            return min(matches, key=lambda match: match.start)
+        return self.fuzzy(phrase)
@@ -0,0 +1,197 @@
+import numpy as np
+
+
+class WordTable:
+    """Column-oriented storage for the words of one or more transcripts.
+
+    Each word is a row across parallel arrays: an index into ``vocab``, its
+    start and end times in seconds, its confidence, the channel it was spoken
+    on and the index of the recognition result (utterance) it belongs to.
+    """
+
+    def __init__(self, vocab, word_ids, start, end, confidence, channel, result_ids):
+        self.vocab = vocab
+        self.word_ids = np.asarray(word_ids, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.channel = np.asarray(channel, dtype=np.int8)
+        self.result_ids = np.asarray(result_ids, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def __repr__(self):
+        return f"WordTable(words={len(self)}, vocab={len(self.vocab)}, channels={self.channels.tolist()})"
+
+    @property
+    def channels(self):
+        return np.unique(self.channel)
+
+    @property
+    def words(self):
+        # Chaînes des mots, dans l'ordre des lignes
+        return np.asarray(self.vocab, dtype=object)[self.word_ids]
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [], [])
+
+    @classmethod
+    def _from_rows(cls, rows, channel):
+        # rows : (mot, début, fin, confiance, index du résultat)
+        vocab_index = {}
+        word_ids = [vocab_index.setdefault(row[0], len(vocab_index)) for row in rows]
+        columns = list(zip(*rows)) if rows else [[], [], [], [], []]
+        return cls(
+            list(vocab_index),
+            word_ids,
+            columns[1],
+            columns[2],
+            columns[3],
+            np.full(len(rows), channel, dtype=np.int8),
+            columns[4],
+        )
+
+    @classmethod
+    def from_dict(cls, transcript, channel=0):
+        # Structure JSON produite par transcribe_gcs_large (results/alternatives/words)
+        rows = [
+            (word['word'], word['start_time'], word['end_time'], word['confidence'], result_id)
+            for result_id, result in enumerate(transcript['results'])
+            if result['alternatives']
+            for word in result['alternatives'][0].get('words', [])
+        ]
+        return cls._from_rows(rows, channel)
+
+    @classmethod
+    def from_results(cls, results, channel=0):
+        # Résultats bruts de l'API Speech-to-Text
+        rows = [
+            (word.word, word.start_time.total_seconds(), word.end_time.total_seconds(), word.confidence, result_id)
+            for result_id, result in enumerate(results)
+            if result.alternatives
+            for word in result.alternatives[0].words
+        ]
+        return cls._from_rows(rows, channel)
+
+    @classmethod
+    def concat(cls, tables):
+        # Fusionner plusieurs tables en une seule, vocabulaire commun
+        vocab_index = {}
+        word_ids = []
+        for table in tables:
+            remap = np.array([vocab_index.setdefault(word, len(vocab_index)) for word in table.vocab], dtype=np.int32)
+            word_ids.append(remap[table.word_ids] if len(table) else table.word_ids)
+        return cls(
+            list(vocab_index),
+            np.concatenate(word_ids) if tables else [],
+            np.concatenate([table.start for table in tables]) if tables else [],
+            np.concatenate([table.end for table in tables]) if tables else [],
+            np.concatenate([table.confidence for table in tables]) if tables else [],
+            np.concatenate([table.channel for table in tables]) if tables else [],
+            np.concatenate([table.result_ids for table in tables]) if tables else [],
+        )
+
+    def take(self, indices):
+        # Sous-table (masque booléen ou indices), même vocabulaire
+        return WordTable(
+            self.vocab,
+            self.word_ids[indices],
+            self.start[indices],
+            self.end[indices],
+            self.confidence[indices],
+            self.channel[indices],
+            self.result_ids[indices],
+        )
+
+    def for_channel(self, channel):
+        return self.take(self.channel == channel)
+
+    def with_channel(self, channel):
+        # Même table, tous les mots réattribués au canal donné
+        return WordTable(self.vocab, self.word_ids, self.start, self.end, self.confidence,
+                         np.full(len(self), channel, dtype=np.int8), self.result_ids)
+
+    def utterances(self):
+        # (canal, texte, début du premier mot) pour chaque résultat de reconnaissance
+        words = self.words
+        keys = (self.channel.astype(np.int64) << 32) | self.result_ids
+        return [
+            (int(self.channel[a]), ' '.join(words[a:b]), float(self.start[a]))
+            for a, b in _runs(keys)
+        ]
+
+    def to_dict(self):
+        # Retour à la structure JSON d'origine (un seul canal)
+        results = []
+        words = self.words
+        for a, b in _runs(self.result_ids):
+            results.append({
+                "alternatives": [{
+                    "transcript": ' '.join(words[a:b]),
+                    "words": [
+                        {
+                            "word": word,
+                            "start_time": start,
+                            "end_time": end,
+                            "confidence": confidence
+                        } for word, start, end, confidence in zip(
+                            words[a:b].tolist(),
+                            self.start[a:b].tolist(),
+                            self.end[a:b].tolist(),
+                            self.confidence[a:b].astype(np.float64).tolist()
+                        )
+                    ]
+                }]
+            })
+        return {"results": results}
+
+
+    def save(self, file):
+        # Format binaire compact : colonnes numpy compressées, vocabulaire en UTF-8
+        np.savez_compressed(
+            file,
+            vocab=np.array(self.vocab, dtype=str),
+            word_ids=self.word_ids,
+            start=self.start,
+            end=self.end,
+            confidence=self.confidence,
+            channel=self.channel,
+            result_ids=self.result_ids,
+        )
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            table = cls(
+                data['vocab'].tolist(),
+                data['word_ids'],
+                data['start'],
+                data['end'],
+                data['confidence'],
+                data['channel'],
+                data['result_ids'],
+            )
+        return table
+
+    def freeze(self):
+        # Lecture seule : la table peut être partagée entre sessions sans copie
+        for column in (self.word_ids, self.start, self.end, self.confidence, self.channel, self.result_ids):
+            column.flags.writeable = False
+        return self
+
+
+def _runs(values):
+    # (début, fin) des suites de valeurs identiques
+    if not len(values):
+        return []
+    boundaries = np.flatnonzero(np.diff(values) != 0) + 1
+    return list(zip(np.concatenate(([0], boundaries)).tolist(), np.concatenate((boundaries, [len(values)])).tolist()))
+
+
+def as_word_table(transcript, channel=0):
+    # Accepter indifféremment une WordTable ou la structure JSON de Speech-to-Text
+    if isinstance(transcript, WordTable):
+        return transcript
+    return WordTable.from_dict(transcript, channel=channel)
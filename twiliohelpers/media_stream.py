@@ -0,0 +1,383 @@
+from google.cloud import speech
+from transcribe.transcribe import response_to_dict
+from transcribe.conversation import ConversationBuilder
+import numpy as np
+import base64
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LIVE_TRANSCRIPTS_DIR = "live_transcripts"
+SAMPLE_RATE = 8000  # Twilio Media Streams: μ-law 8 kHz mono par piste
+BYTES_PER_SECOND = SAMPLE_RATE * 2  # après décodage en PCM 16 bits
+FRAME_SECONDS = 0.02  # durée d'un message media de Twilio
+STREAM_LIMIT_SECONDS = 280  # Google coupe les flux de reconnaissance vers 5 minutes
+# Un mot de l'audio déjà transmis peut encore arriver jusqu'à ce délai après sa fin
+RECOGNITION_DELAY_SECONDS = 10
+ADVANCE_INTERVAL_SECONDS = 1  # fréquence d'avancée d'un canal sans nouveaux résultats
+
+# Piste Twilio -> index de canal (0 = caller, 1 = receiver, comme process_and_upload_audio)
+TRACK_CHANNELS = {"inbound": 0, "outbound": 1}
+
+
+def _build_ulaw_table():
+    # Table de décodage G.711 μ-law -> PCM 16 bits pour les 256 codes possibles
+    codes = ~np.arange(256, dtype=np.uint8)
+    sign = codes & 0x80
+    exponent = (codes >> 4) & 0x07
+    mantissa = (codes & 0x0F).astype(np.int32)
+    magnitude = ((mantissa << 3) + 0x84) << exponent.astype(np.int32)
+    samples = magnitude - 0x84
+    return np.where(sign != 0, -samples, samples).astype("<i2")
+
+
+ULAW_TABLE = _build_ulaw_table()
+
+
+def decode_ulaw(payload):
+    # payload base64 -> PCM LINEAR16 little-endian
+    codes = np.frombuffer(base64.b64decode(payload), dtype=np.uint8)
+    return ULAW_TABLE[codes].tobytes()
+
+
+class GoogleStreamingRecognizer:
+    def __init__(self, credentials, language_code="fr-CA"):
+        self.client = speech.SpeechClient(credentials=credentials)
+        self.config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                sample_rate_hertz=SAMPLE_RATE,
+                language_code=language_code,
+                use_enhanced=True,
+                model="telephony",
+                enable_automatic_punctuation=True,
+                enable_word_time_offsets=True,
+                enable_word_confidence=True,
+            ),
+            interim_results=False,
+        )
+
+    def stream(self, audio_chunks):
+        # Consomme un itérable de blocs PCM et produit les résultats finaux
+        requests = (speech.StreamingRecognizeRequest(audio_content=chunk) for chunk in audio_chunks)
+        for response in self.client.streaming_recognize(config=self.config, requests=requests):
+            for result in response.results:
+                if result.is_final:
+                    yield result
+
+
+class TrackTranscriber:
+    """Feeds one call track into streaming recognition on a background thread.
+
+    Final results are appended to ``transcript`` in the same structure as
+    ``transcribe_gcs_large`` so the conversation can be rebuilt at any time.
+    Word times are in seconds from the start of the Twilio stream: the track
+    starts at ``start`` and frames carry their own timestamps.
+    """
+
+    def __init__(self, recognizer, on_result=None, start=0.0):
+        self.recognizer = recognizer
+        self.on_result = on_result
+        self.start = start
+        self.transcript = {"results": []}
+        self.lock = threading.Lock()
+        self.position = start  # fin de l'audio transmis, en secondes depuis le début du flux
+        self._chunks = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, pcm, timestamp=None):
+        # Trames perdues : combler l'écart par du silence pour garder les temps alignés
+        if timestamp is not None and timestamp - self.position >= FRAME_SECONDS:
+            self._put(bytes(2 * round((timestamp - self.position) * SAMPLE_RATE)))
+        self._put(pcm)
+
+    def _put(self, pcm):
+        self.position += len(pcm) / BYTES_PER_SECOND
+        self._chunks.put(pcm)
+
+    def close(self, timeout=30):
+        self._chunks.put(None)
+        self._thread.join(timeout)
+
+    def _stream_chunks(self, fed):
+        # Un flux s'arrête après STREAM_LIMIT_SECONDS d'audio ; le suivant reprend
+        while fed[0] < STREAM_LIMIT_SECONDS * BYTES_PER_SECOND:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._closed = True
+                return
+            fed[0] += len(chunk)
+            yield chunk
+
+    def _run(self):
+        offset = self.start
+        while not self._closed:
+            fed = [0]
+            try:
+                for result in self.recognizer.stream(self._stream_chunks(fed)):
+                    self._add_result(result, offset)
+            except Exception as e:
+                # Reprendre sur un nouveau flux ; attendre si rien n'a été consommé
+                logger.error(f"Streaming recognition error: {str(e)}")
+                if fed[0] == 0:
+                    time.sleep(1)
+            offset += fed[0] / BYTES_PER_SECOND
+
+    def _add_result(self, result, offset):
+        entry = response_to_dict([result])["results"][0]
+        # Les temps sont relatifs au début du flux courant
+        for alternative in entry["alternatives"]:
+            for word in alternative["words"]:
+                word["start_time"] += offset
+                word["end_time"] += offset
+        with self.lock:
+            self.transcript["results"].append(entry)
+        if self.on_result is not None:
+            self.on_result(entry)
+
+
+def shift_entry(entry, offset):
+    # Résultat ramené au temps de l'enregistrement ; les mots d'avant le décroché sont retirés
+    alternatives = []
+    for alternative in entry["alternatives"]:
+        words = [dict(word, start_time=word["start_time"] - offset, end_time=word["end_time"] - offset)
+                 for word in alternative["words"] if word["start_time"] >= offset]
+        if len(words) < len(alternative["words"]):
+            alternative = dict(alternative, transcript=" ".join(word["word"] for word in words))
+        alternatives.append(dict(alternative, words=words))
+    return dict(entry, alternatives=alternatives)
+
+
+class MediaStreamSession:
+    """State of one Twilio Media Streams websocket connection.
+
+    The stream starts before the call is answered but the recording only
+    at the answer, so results are held until ``mark_answered`` gives the
+    stream time of the answer, then saved in recording time.
+
+    During the call each save only appends: new results to a journal and
+    newly finalized turns to the conversation. The complete transcripts are
+    written once, when the stream closes.
+    """
+
+    def __init__(self, recognizer_factory, store_dir=LIVE_TRANSCRIPTS_DIR):
+        self.recognizer_factory = recognizer_factory
+        self.store_dir = store_dir
+        self.call_sid = None
+        self.tracks = {}
+        self.advanced = {}  # dernier instant transmis au builder par canal
+        self.stream_time = 0.0  # fin de l'audio reçu, en secondes depuis le début du flux
+        self.answer_offset = None  # instant du décroché dans le flux, inconnu jusqu'au rappel
+        self.results = [[] for _ in TRACK_CHANNELS]  # résultats par canal, au temps de l'enregistrement
+        self._unanswered = []  # (canal, résultat) reçus avant que le décroché soit connu
+        self._unsaved = []  # (canal, résultat) pas encore ajoutés au journal
+        self._saved_lines = 0  # lignes de la conversation déjà écrites
+        self.save_lock = threading.Lock()
+        # Conversation construite au fil des résultats, seuls les nouveaux mots sont fusionnés
+        self.builder = ConversationBuilder(channel_count=len(TRACK_CHANNELS))
+
+    def handle_message(self, message):
+        # Retourne False quand Twilio signale la fin du flux
+        event = message.get("event")
+        if event == "start":
+            self.call_sid = message["start"]["callSid"]
+            with _sessions_lock:
+                _sessions[self.call_sid] = self
+            # Les fichiers ne font que grandir pendant l'appel : repartir de zéro
+            for path in (live_transcript_path(self.call_sid, self.store_dir),
+                         live_results_path(self.call_sid, self.store_dir),
+                         live_conversation_path(self.call_sid, self.store_dir)):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info(f"Media stream started for call {self.call_sid}")
+        elif event == "media":
+            media = message["media"]
+            channel = TRACK_CHANNELS.get(media.get("track"))
+            if channel is None:
+                return True
+            # Horodatage Twilio en millisecondes depuis le début du flux
+            timestamp = int(media["timestamp"]) / 1000 if "timestamp" in media else None
+            if channel not in self.tracks:
+                self.tracks[channel] = TrackTranscriber(
+                    self.recognizer_factory(),
+                    on_result=lambda entry, channel=channel: self._on_result(channel, entry),
+                    start=timestamp or 0.0
+                )
+            track = self.tracks[channel]
+            track.feed(decode_ulaw(media["payload"]), timestamp)
+            self.stream_time = max(self.stream_time, track.position)
+            if self.answer_offset is not None:
+                self._advance(channel, track.position - self.answer_offset - RECOGNITION_DELAY_SECONDS)
+        elif event == "stop":
+            return False
+        return True
+
+    def mark_answered(self, offset=None):
+        # Décroché : l'enregistrement commence à offset (par défaut, l'audio reçu jusqu'ici)
+        with self.save_lock:
+            if self.answer_offset is not None:
+                return
+            self.answer_offset = self.stream_time if offset is None else offset
+            logger.info(f"Call {self.call_sid} answered {self.answer_offset:.2f} s into the media stream")
+            for channel, entry in self._unanswered:
+                self._add_result(channel, entry)
+            self._unanswered = []
+        self.save()
+
+    def transcripts(self):
+        # (caller, receiver), une transcription vide pour une piste muette
+        return [{"results": list(results)} for results in self.results]
+
+    def _advance(self, channel, until):
+        # Une piste muette ne produit aucun résultat : sans cela, elle bloquerait
+        # la finalisation des tours jusqu'à la fin de l'appel
+        if until < self.advanced.get(channel, 0.0) + ADVANCE_INTERVAL_SECONDS:
+            return
+        self.advanced[channel] = until
+        with self.save_lock:
+            self.builder.advance(channel, until)
+
+    def _on_result(self, channel, entry):
+        with self.save_lock:
+            if self.answer_offset is None:
+                self._unanswered.append((channel, entry))
+                return
+            self._add_result(channel, entry)
+        self.save()
+
+    def _add_result(self, channel, entry):
+        # Appelé sous save_lock
+        entry = shift_entry(entry, self.answer_offset)
+        words = entry["alternatives"][0]["words"] if entry["alternatives"] else []
+        if not words:
+            return
+        self.results[channel].append(entry)
+        self._unsaved.append((channel, entry))
+        self.builder.add_words(channel, {"results": [entry]}, until=words[-1]["end_time"])
+
+    def save(self):
+        # Seulement le nouveau : le coût suit les nouveaux mots, pas la longueur de l'appel
+        if self.call_sid is None:
+            return
+        with self.save_lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            if self._unsaved:
+                with open(live_results_path(self.call_sid, self.store_dir), "a", encoding="utf-8") as f:
+                    for channel, entry in self._unsaved:
+                        f.write(json.dumps({"channel": channel, "result": entry}, ensure_ascii=False) + "\n")
+                self._unsaved = []
+
+            lines = self.builder.finalized_lines[self._saved_lines:]
+            if lines:
+                with open(live_conversation_path(self.call_sid, self.store_dir), "a", encoding="utf-8") as f:
+                    f.write(("\n" if self._saved_lines else "") + "\n".join(lines))
+                self._saved_lines += len(lines)
+
+    def _save_transcripts(self):
+        # Fin de l'appel : transcriptions complètes, qui remplacent le journal
+        with self.save_lock:
+            fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.transcripts(), f, ensure_ascii=False)
+            os.replace(temp_path, live_transcript_path(self.call_sid, self.store_dir))
+            if os.path.exists(live_results_path(self.call_sid, self.store_dir)):
+                os.remove(live_results_path(self.call_sid, self.store_dir))
+
+    def close(self):
+        for track in self.tracks.values():
+            track.close()
+        if self.answer_offset is None:
+            # Aucun rappel de décroché : les temps restent ceux du flux
+            logger.warning(f"No answer time for call {self.call_sid}, live transcript kept in stream time")
+            self.mark_answered(0.0)
+        with self.save_lock:
+            self.builder.finish()
+        self.save()
+        if self.call_sid is not None:
+            self._save_transcripts()
+        with _sessions_lock:
+            if _sessions.get(self.call_sid) is self:
+                del _sessions[self.call_sid]
+        logger.info(f"Media stream closed for call {self.call_sid}")
+
+
+# Sessions en cours par CallSid, pour le rappel de décroché du numéro composé
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def mark_answered(call_sid):
+    # Retourne False si aucun flux n'est en cours pour cet appel
+    with _sessions_lock:
+        session = _sessions.get(call_sid)
+    if session is None:
+        return False
+    session.mark_answered()
+    return True
+
+
+def run_media_stream(ws, session):
+    # Boucle d'une connexion websocket : messages JSON de Twilio jusqu'à "stop" ou la déconnexion
+    try:
+        while True:
+            message = ws.receive()
+            if message is None or not session.handle_message(json.loads(message)):
+                break
+    finally:
+        session.close()
+
+
+def live_transcript_path(call_sid, store_dir=LIVE_TRANSCRIPTS_DIR):
+    return os.path.join(store_dir, f"{call_sid}.json")
+
+
+def live_conversation_path(call_sid, store_dir=LIVE_TRANSCRIPTS_DIR):
+    return os.path.join(store_dir, f"{call_sid}.txt")
+
+
+def live_results_path(call_sid, store_dir=LIVE_TRANSCRIPTS_DIR):
+    # Journal des résultats pendant l'appel, une ligne JSON par résultat
+    return os.path.join(store_dir, f"{call_sid}.jsonl")
+
+
+def load_live_conversation(call_sid, store_dir=LIVE_TRANSCRIPTS_DIR):
+    # Conversation réarrangée pendant l'appel, ou None tant que le flux n'est pas fermé
+    # (seuls les tours finalisés y sont écrits avant la fin)
+    if not os.path.exists(live_transcript_path(call_sid, store_dir)):
+        return None
+    try:
+        with open(live_conversation_path(call_sid, store_dir), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_live_transcripts(call_sid, store_dir=LIVE_TRANSCRIPTS_DIR):
+    # Transcriptions (caller, receiver) accumulées pendant l'appel, ou None ;
+    # depuis le journal si le flux n'a pas été fermé
+    try:
+        with open(live_transcript_path(call_sid, store_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    try:
+        with open(live_results_path(call_sid, store_dir), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    transcripts = [{"results": []} for _ in TRACK_CHANNELS]
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # dernière ligne interrompue
+        transcripts[record["channel"]]["results"].append(record["result"])
+    return transcripts
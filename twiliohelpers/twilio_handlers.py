@@ -1,4 +1,5 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask_sock import Sock
 from twilio.rest import Client
 from dotenv import load_dotenv
 import os
@@ -10,6 +11,8 @@ import logging
 import requests
 from requests.auth import HTTPBasicAuth
 import io
+from twiliohelpers.media_stream import MediaStreamSession, GoogleStreamingRecognizer, run_media_stream, mark_answered
+from tracing import TraceMetrics
 
 
 # Set up logging
@@ -20,6 +23,7 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = Flask(__name__)
+sock = Sock(app)
 
 # Initialize Twilio client
 twilio_client = Client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
@@ -39,6 +43,26 @@ credentials_dict = {
 }
 
 credentials = service_account.Credentials.from_service_account_info(credentials_dict)
+
+# Compteurs Prometheus alimentés par le journal des étapes (app Streamlit et serveur)
+trace_metrics = TraceMetrics()
+
+def media_stream_url():
+    return os.getenv('NGROK_URL').replace("https://", "wss://").replace("http://", "ws://") + "/media_stream"
+
+def answered_callback():
+    # Rappel au décroché du numéro composé : l'enregistrement (record-from-answer) commence alors
+    return dict(status_callback=f"{os.getenv('NGROK_URL')}/call_answered", status_callback_event="answered")
+
+@sock.route('/media_stream')
+def media_stream(ws):
+    # Twilio Media Streams : une connexion websocket par appel, deux pistes μ-law
+    run_media_stream(ws, MediaStreamSession(lambda: GoogleStreamingRecognizer(credentials)))
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(trace_metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/twiml", methods=['POST'])
 def twiml():
     logger.info("Requête reçue sur /twiml")
@@ -48,6 +72,10 @@ def twiml():
     logger.info(f"Numéro du destinataire : {recipient}")
     
     response.say("Cet appel sera enregistré pour transcription. Connexion en cours.")
+
+    # Diffuser les deux pistes vers /media_stream pour la transcription en direct
+    start = response.start()
+    start.stream(url=media_stream_url(), track="both_tracks")
     
     dial = response.dial(
         record='record-from-answer-dual', 
@@ -55,11 +83,19 @@ def twiml():
         recordingChannels='dual',
         action=f"{os.getenv('NGROK_URL')}/call_complete"
     )
-    dial.number(recipient)
+    dial.number(recipient, **answered_callback())
     
     logger.info("Réponse TwiML générée")
     return str(response)
 
+@app.route("/call_answered", methods=['POST'])
+def call_answered():
+    # Le flux est ouvert sur l'appel parent, le rappel vient de l'appel composé
+    call_sid = request.form.get('ParentCallSid') or request.form.get('CallSid')
+    if not mark_answered(call_sid):
+        logger.warning(f"Appel {call_sid} décroché sans flux en cours")
+    return "", 200
+
 @app.route("/call_complete", methods=['POST'])
 def call_complete():
     logger.info("Appel terminé")
@@ -90,8 +126,10 @@ def handle_call():
     forward_number = request.args.get('forward')
     response = VoiceResponse()
     response.say("Cet appel est en cours de transfert. Veuillez patienter.")
+    start = response.start()
+    start.stream(url=media_stream_url(), track="both_tracks")
     dial = Dial(record='record-from-answer', recording_channels='dual', caller_id=forward_number)
-    dial.number(to_number, codec='opus')
+    dial.number(to_number, codec='opus', **answered_callback())
     response.append(dial)
     
     return str(response)
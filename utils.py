@@ -1,7 +1,8 @@
 import streamlit as st
-from typing import Dict, Any
+from typing import Any, Dict, List, Tuple
 import re
 import json
+import math
 
 def check_password():
     """Returns `True` if the user entered the correct password."""
@@ -36,18 +37,191 @@ def extract_form_without_confidence(form: Dict[str, any]) -> Dict[str, any]:
         cleaned_form[key] = value['réponse']
     return cleaned_form
 
+# Réparations locales tentées sur un champ invalide : barres obliques inverses isolées, virgules finales
+_STRAY_BACKSLASH = re.compile(r'(?<!\\)\\(?!["\\/bfnrt]|u[0-9a-fA-F]{4})')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_STRING_SPECIAL = re.compile(r'[\\"]')
+_STRUCTURE = re.compile(r'["{}\[\],]')
+
+
+def _confidence_score(score):
+    # Nombre fini, éventuellement écrit en chaîne ("0.9") ; None sinon
+    if isinstance(score, bool):
+        return None
+    if isinstance(score, str):
+        try:
+            score = float(score)
+        except ValueError:
+            return None
+    if isinstance(score, (int, float)) and math.isfinite(score):
+        return float(score)
+    return None
+
+
+def normalize_confidence(confidence):
+    """Return ``confidence`` as a non-empty list of floats, or None if it is not one.
+
+    A single score is wrapped in a list and numeric strings are converted; a
+    missing or empty confidence is unknown and becomes ``[0.0]``, so that
+    the field is flagged at validation.
+    """
+    if confidence is None or confidence == []:
+        return [0.0]
+    scores = confidence if isinstance(confidence, list) else [confidence]
+    scores = [_confidence_score(score) for score in scores]
+    return None if None in scores else scores
+
+
+def _is_confidence_list(confidence):
+    # Déjà normalisée : liste non vide de nombres
+    return isinstance(confidence, list) and bool(confidence) and all(
+        isinstance(score, (int, float)) and not isinstance(score, bool) for score in confidence)
+
+
+def _parse_field(entry: str):
+    # entry : '"champ": {...}' tel qu'il apparaît dans l'objet du formulaire
+    candidates = [entry, _STRAY_BACKSLASH.sub(r'\\\\', entry)]
+    candidates.append(_TRAILING_COMMA.sub(r'\1', candidates[-1]))
+    for candidate in candidates:
+        try:
+            parsed = json.loads("{" + candidate + "}", strict=False)
+        except json.JSONDecodeError:
+            continue
+        if len(parsed) == 1:
+            (key, value), = parsed.items()
+            if isinstance(value, dict) and 'réponse' in value:
+                answer = value['réponse']
+                confidence = normalize_confidence(value.get('confiance'))
+                # "réponse": null est une réponse manquante, pas le texte "None"
+                if answer is None or confidence is None:
+                    return None
+                # Réponse en plusieurs morceaux : les mots bout à bout, comme dans la transcription
+                if isinstance(answer, list):
+                    value['réponse'] = ' '.join(str(item) for item in answer if item is not None)
+                else:
+                    value['réponse'] = str(answer)
+                value['confiance'] = confidence
+                return key, value
+    return None
+
+
+class FormStreamParser:
+    """Incremental, tolerant parser of the form JSON in a model response.
+
+    ``feed`` takes the response text as it is streamed and returns the
+    fields completed by that piece, as soon as the closing brace of their
+    value arrives. Text around the JSON object is ignored; a malformed field
+    is repaired when possible, otherwise recorded in ``errors`` and skipped
+    without losing the rest of the form.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.errors = []
+        self.started = False  # accolade ouvrante du formulaire vue
+        self.finished = False  # accolade fermante du formulaire vue
+        self._buffer = ""
+        self._position = 0
+        self._entry_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def __repr__(self):
+        return f"FormStreamParser(fields={len(self.fields)}, errors={len(self.errors)}, finished={self.finished})"
+
+    def _complete(self, end, completed):
+        entry = self._buffer[self._entry_start:end].strip().strip(",").strip()
+        if entry:
+            field = _parse_field(entry)
+            if field is None:
+                self.errors.append(entry)
+            else:
+                self.fields[field[0]] = field[1]
+                completed.append(field)
+        self._entry_start = end
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        completed = []
+        if self.finished:
+            return completed
+        self._buffer += text
+        buffer = self._buffer
+        position = self._position
+        length = len(buffer)
+        while position < length:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    position += 1
+                    continue
+                match = _STRING_SPECIAL.search(buffer, position)
+                if match is None:
+                    position = length
+                    break
+                position = match.end()
+                if match.group() == "\\":
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                continue
+            if not self.started:
+                start = buffer.find("{", position)
+                if start < 0:
+                    position = length
+                    break
+                self.started = True
+                self._depth = 1
+                position = self._entry_start = start + 1
+                continue
+
+            # Sauter directement au prochain caractère de structure
+            match = _STRUCTURE.search(buffer, position)
+            if match is None:
+                position = length
+                break
+            char = match.group()
+            position = match.end()
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    # Valeur d'un champ refermée : le champ est complet
+                    self._complete(position, completed)
+                elif self._depth == 0:
+                    self._complete(position - 1, completed)
+                    self.finished = True
+                    break
+            elif self._depth == 1:
+                self._complete(position, completed)
+
+        # Oublier le texte déjà traité
+        self._buffer = buffer[self._entry_start:] if self.started else ""
+        self._position = position - self._entry_start if self.started else 0
+        self._entry_start = 0
+        return completed
+
+
 def extract_form_with_confidence(text: str) -> Dict[str, Any]:
-    json_match = re.search(r'(\{[\s\S]*\})', text)
-    if not json_match:
+    start = text.find("{")
+    if start < 0:
         raise ValueError("No JSON object found in the text")
-    
-    json_str = json_match.group(1)
-    json_lines = [line for line in json_str.split('\n') if ':' in line or '{' in line or '}' in line]
-    cleaned_json_str = '\n'.join(json_lines)
-    cleaned_json_str = re.sub(r'(?<!\\)\\(?!["\\/bfnrt]|u[0-9a-fA-F]{4})', r'\\\\', cleaned_json_str)
-    
+
+    # Réponse complète et bien formée : un seul décodage, le texte qui suit est ignoré
     try:
-        return json.loads(cleaned_json_str)
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-        return {}
\ No newline at end of file
+        form, _ = json.JSONDecoder(strict=False).raw_decode(text, start)
+        if all(isinstance(value, dict) and isinstance(value.get('réponse'), str)
+               and _is_confidence_list(value.get('confiance')) for value in form.values()):
+            return form
+    except json.JSONDecodeError:
+        pass
+
+    # Sinon, champ par champ : seuls les champs irréparables sont perdus
+    parser = FormStreamParser()
+    parser.feed(text[start:])
+    for entry in parser.errors:
+        print(f"Error decoding JSON field, skipped: {entry[:80]}")
+    return parser.fields